@@ -2,11 +2,18 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import EmailStr
 from bson import ObjectId
 from .schemas import UserCreate, UserLogin, TokenResponse
-from .utils import hash_password, verify_password, create_access_token
+from .utils import hash_password_async, verify_password_async, create_access_token, HashPoolBusy
 from .db import get_db
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+def hash_pool_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Servidor ocupado, intente de nuevo",
+        headers={"Retry-After": "1"},
+    )
+
 @router.post("/register", status_code=201)
 async def register(payload: UserCreate, db = Depends(get_db)):
     users = db["users"]
@@ -14,9 +21,14 @@ async def register(payload: UserCreate, db = Depends(get_db)):
     if existing:
         raise HTTPException(status_code=400, detail="El email ya está registrado")
 
+    try:
+        hashed = await hash_password_async(payload.password)
+    except HashPoolBusy:
+        raise hash_pool_busy()
+
     user_doc = {
         "email": payload.email,
-        "password": hash_password(payload.password),
+        "password": hashed,
     }
     res = await users.insert_one(user_doc)
     return {"id": str(res.inserted_id), "email": payload.email}
@@ -25,7 +37,11 @@ async def register(payload: UserCreate, db = Depends(get_db)):
 async def login(payload: UserLogin, db = Depends(get_db)):
     users = db["users"]
     user = await users.find_one({"email": payload.email})
-    if not user or not verify_password(payload.password, user["password"]):
+    try:
+        valid = user is not None and await verify_password_async(payload.password, user["password"])
+    except HashPoolBusy:
+        raise hash_pool_busy()
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciales inválidas")
 
     token = create_access_token(str(user["_id"]))
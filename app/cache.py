@@ -0,0 +1,99 @@
+import hashlib
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+from bson import ObjectId
+from fastapi import Request
+from .config import settings
+
+# Caché de respuestas de lectura por usuario. La clave incluye la versión de los
+# gastos del usuario (users.expenses_version, compartida por todos los workers);
+# cada escritura la incrementa, con lo que las entradas anteriores dejan de
+# usarse sin tener que buscarlas y caducan por TTL.
+
+class MemoryBackend:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+class RedisBackend:
+    # Compartido entre workers; requiere el paquete redis (pip install redis)
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requiere el paquete 'redis'")
+        self.redis = redis.from_url(url)
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.redis.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self.redis.set(key, value, ex=ttl)
+
+class ResponseCache:
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, scope: str, user_id: ObjectId, version: int, request: Request, variant: str = "") -> str:
+        # version: la de expenses_version leída para esta petición (la misma del ETag)
+        # variant: datos que cambian la respuesta sin estar en la URL (límites de fecha resueltos)
+        query = urlencode(sorted(request.query_params.multi_items()))
+        if variant:
+            query += ":" + hashlib.sha1(variant.encode()).hexdigest()[:16]
+        return f"cache:{scope}:{user_id}:{version}:{query}"
+
+    async def get(self, key: str) -> bytes | None:
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes):
+        await self.backend.set(key, value, self.ttl)
+
+    def stats(self) -> dict:
+        return {"backend": settings.CACHE_BACKEND, "hits": self.hits, "misses": self.misses}
+
+class NoCache(ResponseCache):
+    def __init__(self):
+        super().__init__(backend=None, ttl=0)
+
+    def key(self, scope: str, user_id: ObjectId, version: int, request: Request, variant: str = "") -> str:
+        return ""
+
+    async def get(self, key: str) -> bytes | None:
+        return None
+
+    async def set(self, key: str, value: bytes):
+        pass
+
+def build_cache() -> ResponseCache:
+    if settings.CACHE_BACKEND == "none":
+        return NoCache()
+    if settings.CACHE_BACKEND == "redis":
+        return ResponseCache(RedisBackend(settings.REDIS_URL), settings.CACHE_TTL)
+    return ResponseCache(MemoryBackend(settings.CACHE_MAX_ENTRIES), settings.CACHE_TTL)
+
+response_cache = build_cache()
@@ -0,0 +1,167 @@
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+from .config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compresores incrementales con la misma interfaz: compress / flush / finish.
+# flush() vacía lo pendiente tras cada trozo para no retrasar el streaming.
+
+class GzipEncoder:
+    def __init__(self, level: int):
+        self.obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self.obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.obj.flush()
+
+class BrotliEncoder:
+    def __init__(self, level: int):
+        self.obj = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.obj.process(data)
+
+    def flush(self) -> bytes:
+        return self.obj.flush()
+
+    def finish(self) -> bytes:
+        return self.obj.finish()
+
+class ZstdEncoder:
+    def __init__(self, level: int):
+        self.obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self.obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self.obj.flush()
+
+def available_encoders() -> dict:
+    encoders = {"gzip": lambda: GzipEncoder(settings.COMPRESSION_GZIP_LEVEL)}
+    if brotli is not None:
+        encoders["br"] = lambda: BrotliEncoder(settings.COMPRESSION_BROTLI_LEVEL)
+    if zstandard is not None:
+        encoders["zstd"] = lambda: ZstdEncoder(settings.COMPRESSION_ZSTD_LEVEL)
+    return encoders
+
+def accepted_encodings(header: str) -> set[str]:
+    accepted = set()
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name and q > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+# Formatos ya comprimidos: recomprimirlos solo gasta CPU
+INCOMPRESSIBLE_TYPES = ("application/vnd.apache.parquet", "application/zip", "application/gzip")
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+        encoders = available_encoders()
+        # Orden de preferencia del servidor, limitado a lo instalado
+        self.encoders = [
+            (name, encoders[name])
+            for name in (e.strip() for e in settings.COMPRESSION_ENCODINGS.split(","))
+            if name in encoders
+        ]
+        self.minimum_size = settings.COMPRESSION_MIN_SIZE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encoders:
+            await self.app(scope, receive, send)
+            return
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        for name, factory in self.encoders:
+            if name in accepted:
+                await CompressionResponder(self.app, name, factory, self.minimum_size)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+class CompressionResponder:
+    def __init__(self, app, name: str, factory, minimum_size: int):
+        self.app = app
+        self.name = name
+        self.factory = factory
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start_message = None
+        self.encoder = None
+        self.passthrough = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            # Respuestas ya codificadas o sin cuerpo se envían tal cual
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                "content-encoding" in headers
+                or message["status"] in (204, 304)
+                or headers.get("content-type", "").startswith(INCOMPRESSIBLE_TYPES)
+            )
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.passthrough:
+            if self.start_message is not None:
+                await self.send(self.start_message)
+                self.start_message = None
+            await self.send(message)
+            return
+
+        if self.encoder is None:
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(self.start_message)
+                self.start_message = None
+                await self.send(message)
+                return
+            self.encoder = self.factory()
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers["Content-Encoding"] = self.name
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+            body = self.encoder.compress(body) + (self.encoder.flush() if more_body else self.encoder.finish())
+            if not more_body:
+                headers["Content-Length"] = str(len(body))
+            await self.send(self.start_message)
+            self.start_message = None
+            await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+            return
+
+        body = self.encoder.compress(body) + (self.encoder.flush() if more_body else self.encoder.finish())
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
@@ -1,11 +1,68 @@
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
+    HOST: str = "0.0.0.0"
+    PORT: int = 8000
+    WEB_CONCURRENCY: int = 0
+    SERVER_LOOP: str = "auto"
+    SERVER_HTTP: str = "auto"
+    SERVER_TIMEOUT: int = 60
+    SERVER_GRACEFUL_TIMEOUT: int = 30
+    SERVER_KEEPALIVE: int = 5
+    SERVER_MAX_REQUESTS: int = 0
+    SERVER_MAX_REQUESTS_JITTER: int = 0
+    SERVER_ACCESS_LOG: bool = True
+    LOG_LEVEL: str = "info"
     MONGO_URI: str = "mongodb://localhost:27017"
     MONGO_DB: str = "expenses_db"
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_MAX_IDLE_TIME_MS: Optional[int] = None
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 30000
+    MONGO_COMPRESSORS: str = ""
+    MONGO_READ_PREFERENCE: str = "primary"
+    EXPENSES_STORAGE: str = "documents"
+    ENSURE_INDEXES: bool = True
+    INDEX_BUILD_BACKGROUND: bool = False
     JWT_SECRET: str = "change-me"
     JWT_ALG: str = "HS256"
     JWT_EXPIRES_MIN: int = 60
+    TOKEN_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_TTL: int = 300
+    CACHE_BACKEND: str = "memory"
+    CACHE_TTL: int = 30
+    CACHE_MAX_ENTRIES: int = 10000
+    REDIS_URL: str = "redis://localhost:6379/0"
+    STREAM_BATCH_SIZE: int = 1000
+    DEFAULT_TIMEZONE: str = "UTC"
+    METRICS_ENABLED: bool = True
+    METRICS_DIR: str = ""
+    METRICS_FLUSH_SECONDS: float = 5.0
+    SLOW_QUERY_MS: int = 200
+    SLOW_QUERY_EXPLAIN_CONCURRENCY: int = 2
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_ENCODINGS: str = "zstd,br,gzip"
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_LEVEL: int = 4
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    BULK_CHUNK_SIZE: int = 1000
+    INSERT_BATCH_ENABLED: bool = False
+    INSERT_BATCH_MAX: int = 500
+    INSERT_BATCH_WINDOW_MS: float = 5.0
+    INSERT_WRITE_CONCERN: str = ""
+    INSERT_JOURNAL: Optional[bool] = None
+    BULK_MAX_ROWS: int = 50000
+    HASH_POOL_WORKERS: int = 4
+    HASH_POOL_QUEUE: int = 64
+    EXPORT_DIR: str = "exports"
+    EXPORT_WORKERS: int = 0
+    EXPORT_BATCH_SIZE: int = 5000
+    EXPORT_POLL_INTERVAL: float = 2.0
+    EXPORT_STALE_SECONDS: int = 300
+    EXPORT_TTL_HOURS: int = 24
+    EXPORT_MAX_ACTIVE: int = 3
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
@@ -1,14 +1,54 @@
+import logging
+import os
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
 from .config import settings
+from .metrics import MongoCommandListener
+
+logger = logging.getLogger(__name__)
 
 _client: AsyncIOMotorClient | None = None
+_client_pid: int | None = None
+
+def client_options() -> dict:
+    options = {
+        "maxPoolSize": settings.MONGO_MAX_POOL_SIZE,
+        "minPoolSize": settings.MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "readPreference": settings.MONGO_READ_PREFERENCE,
+        "event_listeners": [MongoCommandListener()],
+    }
+    if settings.MONGO_MAX_IDLE_TIME_MS is not None:
+        options["maxIdleTimeMS"] = settings.MONGO_MAX_IDLE_TIME_MS
+    # zstd requiere el paquete zstandard y snappy python-snappy
+    if settings.MONGO_COMPRESSORS:
+        options["compressors"] = settings.MONGO_COMPRESSORS
+    return options
 
 def get_client() -> AsyncIOMotorClient:
-    global _client
+    global _client, _client_pid
+    # Un cliente heredado por fork no es seguro: cada worker abre el suyo
+    if _client is not None and _client_pid != os.getpid():
+        _client = None
     if _client is None:
-        _client = AsyncIOMotorClient(settings.MONGO_URI)
+        _client = AsyncIOMotorClient(settings.MONGO_URI, **client_options())
+        _client_pid = os.getpid()
     return _client
 
+async def connect():
+    # Abre el pool y hace un ping para no pagar la conexión en la primera petición
+    client = get_client()
+    try:
+        await client.admin.command("ping")
+    except PyMongoError:
+        logger.exception("No se pudo conectar a MongoDB en %s", settings.MONGO_URI)
+
+def close_client():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
 async def get_db():
     client = get_client()
-    return client[settings.MONGO_DB]
\ No newline at end of file
+    return client[settings.MONGO_DB]
@@ -1,18 +1,50 @@
+import time
+from collections import OrderedDict
+from bson import ObjectId
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
+from .config import settings
 from .utils import decode_token
 
 bearer = HTTPBearer(auto_error=False)
 
-def get_current_user_id(creds: HTTPAuthorizationCredentials = Depends(bearer)) -> str:
+# Caché LRU de tokens ya verificados: token -> (expira_en, sub, ObjectId).
+# Una entrada nunca sobrevive al claim exp del token ni a TOKEN_CACHE_TTL.
+# Solo se usa desde el event loop (dependencias async), no necesita lock.
+_token_cache: OrderedDict[str, tuple[float, str, ObjectId]] = OrderedDict()
+
+def verify_token(token: str) -> tuple[str, ObjectId]:
+    now = time.time()
+    entry = _token_cache.get(token)
+    if entry is not None:
+        if entry[0] > now:
+            _token_cache.move_to_end(token)
+            return entry[1], entry[2]
+        del _token_cache[token]
+
+    payload = decode_token(token)
+    sub = payload.get("sub")
+    if not sub or not ObjectId.is_valid(sub):
+        raise jwt.InvalidTokenError("sub inválido")
+
+    oid = ObjectId(sub)
+    if settings.TOKEN_CACHE_SIZE > 0:
+        _token_cache[token] = (min(payload.get("exp", now), now + settings.TOKEN_CACHE_TTL), sub, oid)
+        if len(_token_cache) > settings.TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return sub, oid
+
+def authenticate(creds: HTTPAuthorizationCredentials | None) -> tuple[str, ObjectId]:
     if creds is None or creds.scheme.lower() != "bearer":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciales faltantes")
     token = creds.credentials
     try:
-        payload = decode_token(token)
-        return payload.get("sub")
+        return verify_token(token)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expirado")
     except jwt.InvalidTokenError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
\ No newline at end of file
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
+
+async def get_current_user_oid(creds: HTTPAuthorizationCredentials = Depends(bearer)) -> ObjectId:
+    return authenticate(creds)[1]
@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import csv
+import logging
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from .config import settings
+from . import storage
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Exportaciones en segundo plano. Los trabajos viven en MongoDB: cualquier worker
+# del servidor puede reclamarlos y cualquiera puede responder por su estado.
+
+EXPORTS = "export_jobs"
+COLUMNS = ("id", "amount", "category", "description", "date")
+PROJECTION = {"amount": 1, "category": 1, "description": 1, "date": 1}
+# Filas por row group de Parquet: grupos pequeños comprimen y se leen peor
+PARQUET_ROW_GROUP = 100_000
+
+_wakeup: asyncio.Event | None = None
+
+def available_formats() -> list[str]:
+    return ["csv", "parquet"] if pyarrow is not None else ["csv"]
+
+def export_path(job_id, fmt: str) -> Path:
+    return Path(settings.EXPORT_DIR) / f"{job_id}.{fmt}"
+
+class CsvExport:
+    def __init__(self, path: Path):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, docs: list[dict]):
+        self.writer.writerows(
+            (str(doc["_id"]), doc["amount"], doc["category"], doc.get("description") or "", doc["date"].isoformat())
+            for doc in docs
+        )
+
+    def close(self):
+        self.file.close()
+
+class ParquetExport:
+    def __init__(self, path: Path):
+        self.schema = pyarrow.schema([
+            ("id", pyarrow.string()),
+            ("amount", pyarrow.float64()),
+            ("category", pyarrow.string()),
+            ("description", pyarrow.string()),
+            ("date", pyarrow.timestamp("ms", tz="UTC")),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="snappy")
+        self.columns = {name: [] for name in COLUMNS}
+
+    def write(self, docs: list[dict]):
+        for doc in docs:
+            self.columns["id"].append(str(doc["_id"]))
+            self.columns["amount"].append(doc["amount"])
+            self.columns["category"].append(doc["category"])
+            self.columns["description"].append(doc.get("description"))
+            self.columns["date"].append(doc["date"])
+        if len(self.columns["id"]) >= PARQUET_ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if self.columns["id"]:
+            self.writer.write_table(pyarrow.table(self.columns, schema=self.schema))
+            self.columns = {name: [] for name in COLUMNS}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+WRITERS = {"csv": CsvExport, "parquet": ParquetExport}
+
+async def enqueue(db, user_id, q: dict, fmt: str) -> dict:
+    # La consulta se guarda ya resuelta: un rango móvil no cambia si el trabajo espera
+    job = {
+        "user_id": user_id,
+        "format": fmt,
+        "query": q,
+        "status": "pending",
+        "rows": 0,
+        "size": None,
+        "error": None,
+        "created_at": datetime.utcnow(),
+        "finished_at": None,
+    }
+    job["_id"] = (await db[EXPORTS].insert_one(job)).inserted_id
+    if _wakeup is not None:
+        _wakeup.set()
+    return job
+
+async def active_jobs(db, user_id) -> int:
+    return await db[EXPORTS].count_documents({"user_id": user_id, "status": {"$in": ["pending", "running"]}})
+
+async def claim(db) -> dict | None:
+    # Los trabajos "running" sin latido reciente son de un worker caído
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=settings.EXPORT_STALE_SECONDS)
+    return await db[EXPORTS].find_one_and_update(
+        {"$or": [{"status": "pending"}, {"status": "running", "heartbeat_at": {"$lt": stale}}]},
+        {"$set": {"status": "running", "started_at": now, "heartbeat_at": now, "rows": 0}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def run_job(db, job: dict):
+    path = export_path(job["_id"], job["format"])
+    partial = path.with_name(path.name + ".part")
+    rows = 0
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Formatear y escribir en disco va a un hilo: el event loop sigue atendiendo peticiones
+        writer = await asyncio.to_thread(WRITERS[job["format"]], partial)
+        try:
+            cursor = storage.find_expenses(db, job["query"], PROJECTION, [("date", -1), ("_id", -1)], batch_size=settings.EXPORT_BATCH_SIZE)
+            batch = []
+            async for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= settings.EXPORT_BATCH_SIZE:
+                    await asyncio.to_thread(writer.write, batch)
+                    rows += len(batch)
+                    batch = []
+                    await db[EXPORTS].update_one({"_id": job["_id"]}, {"$set": {"rows": rows, "heartbeat_at": datetime.utcnow()}})
+            if batch:
+                await asyncio.to_thread(writer.write, batch)
+                rows += len(batch)
+        finally:
+            await asyncio.to_thread(writer.close)
+        os.replace(partial, path)
+    except asyncio.CancelledError:
+        # Parada del proceso: el trabajo vuelve a la cola para otro worker
+        partial.unlink(missing_ok=True)
+        await db[EXPORTS].update_one({"_id": job["_id"]}, {"$set": {"status": "pending", "rows": 0}})
+        raise
+    except Exception as e:
+        logger.exception("Falló la exportación %s", job["_id"])
+        partial.unlink(missing_ok=True)
+        now = datetime.utcnow()
+        await db[EXPORTS].update_one({"_id": job["_id"]}, {"$set": {
+            "status": "failed",
+            "error": str(e),
+            "finished_at": now,
+            "expires_at": now + timedelta(hours=settings.EXPORT_TTL_HOURS),
+        }})
+        return
+
+    now = datetime.utcnow()
+    await db[EXPORTS].update_one({"_id": job["_id"]}, {"$set": {
+        "status": "done",
+        "rows": rows,
+        "size": path.stat().st_size,
+        "finished_at": now,
+        "expires_at": now + timedelta(hours=settings.EXPORT_TTL_HOURS),
+    }})
+
+async def purge_expired(db):
+    async for job in db[EXPORTS].find({"expires_at": {"$lt": datetime.utcnow()}}, {"format": 1}):
+        export_path(job["_id"], job["format"]).unlink(missing_ok=True)
+        await db[EXPORTS].delete_one({"_id": job["_id"]})
+
+async def worker(db):
+    while True:
+        _wakeup.clear()
+        try:
+            job = await claim(db)
+            if job is not None:
+                await run_job(db, job)
+                continue
+            await purge_expired(db)
+        except PyMongoError:
+            logger.exception("Error en el worker de exportaciones")
+        # Los trabajos encolados en este proceso despiertan al worker; los de otros
+        # procesos se ven en el siguiente sondeo
+        try:
+            await asyncio.wait_for(_wakeup.wait(), settings.EXPORT_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+def start_workers(db, count: int) -> list[asyncio.Task]:
+    global _wakeup
+    _wakeup = asyncio.Event()
+    return [asyncio.create_task(worker(db)) for _ in range(count)]
+
+async def _main(count: int):
+    from .db import get_client
+
+    db = get_client()[settings.MONGO_DB]
+    print(f"📦 Worker de exportaciones en marcha ({count} tareas)")
+    await asyncio.gather(*start_workers(db, count))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Procesa exportaciones fuera de los procesos de la API")
+    # EXPORT_WORKERS es para los procesos de la API (0 por defecto): aquí al menos una
+    parser.add_argument("--workers", type=int, default=max(settings.EXPORT_WORKERS, 1), help="Exportaciones simultáneas")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args.workers))
@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import logging
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from . import storage
+
+logger = logging.getLogger(__name__)
+
+# Índices requeridos por colección. Deben coincidir con scripts/init-mongo.js
+REQUIRED_INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    "expenses": [
+        # list_expenses y la paginación por cursor (date, _id), en ambos sentidos
+        IndexModel([("user_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]),
+        # una o varias categorías + orden por fecha (varias: SORT_MERGE sin ordenar en memoria);
+        # su prefijo cubre {user_id, category}
+        IndexModel([("user_id", ASCENDING), ("category", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]),
+        # orden por importe y filtros min_amount/max_amount, con y sin categoría
+        IndexModel([("user_id", ASCENDING), ("amount", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("category", ASCENDING), ("amount", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("date", DESCENDING)]),
+        # búsqueda q= en la descripción; el prefijo user_id limita el índice al usuario
+        IndexModel([("user_id", ASCENDING), ("description", TEXT)], default_language="spanish"),
+    ],
+    "expense_rollups": [
+        IndexModel([("user_id", ASCENDING), ("year_month", ASCENDING), ("category", ASCENDING)], unique=True),
+    ],
+    "export_jobs": [
+        # cola: el worker reclama el pendiente más antiguo
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+        # límite de exportaciones activas por usuario
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)]),
+    ],
+}
+
+def required_indexes(collection: str, timeseries: bool | None = None) -> list[IndexModel]:
+    # Las colecciones time-series no admiten índices de texto
+    if timeseries is None:
+        timeseries = storage.timeseries()
+    models = REQUIRED_INDEXES[collection]
+    if collection == storage.EXPENSES and timeseries:
+        return [model for model in models if TEXT not in model.document["key"].values()]
+    return models
+
+def _key(spec) -> tuple:
+    # MongoDB lista los campos de un índice de texto como _fts/_ftsx
+    key = []
+    for field, direction in spec:
+        if direction == TEXT:
+            if ("_fts", TEXT) not in key:
+                key += [("_fts", TEXT), ("_ftsx", 1)]
+        elif field != "_ftsx":
+            # hashed, 2dsphere, 2d... se comparan tal cual
+            key.append((field, direction if isinstance(direction, str) else int(direction)))
+    return tuple(key)
+
+async def index_report(db) -> dict:
+    report = {}
+    for collection in REQUIRED_INDEXES:
+        models = required_indexes(collection)
+        existing = await db[collection].index_information()
+        existing_keys = {_key(info["key"]): name for name, info in existing.items() if name != "_id_"}
+        required = {_key(model.document["key"].items()): model for model in models}
+        report[collection] = {
+            "missing": [model.document["name"] for key, model in required.items() if key not in existing_keys],
+            "extra": [name for key, name in existing_keys.items() if key not in required],
+        }
+    return report
+
+async def ensure_indexes(db) -> dict:
+    report = await index_report(db)
+    for collection, status in report.items():
+        if status["extra"]:
+            logger.warning("Índices no declarados en %s: %s", collection, ", ".join(status["extra"]))
+        missing = [m for m in required_indexes(collection) if m.document["name"] in status["missing"]]
+        if missing:
+            logger.info("Creando índices en %s: %s", collection, ", ".join(status["missing"]))
+            await db[collection].create_indexes(missing)
+    return report
+
+async def ensure_indexes_safely(db):
+    # En el arranque un fallo de índices no debe impedir servir peticiones
+    try:
+        await ensure_indexes(db)
+    except Exception:
+        logger.exception("No se pudieron verificar los índices")
+
+async def _main(apply: bool):
+    from .db import get_client
+    from .config import settings
+
+    db = get_client()[settings.MONGO_DB]
+    if apply:
+        # Con EXPENSES_STORAGE=timeseries la colección debe existir antes que sus índices
+        from . import storage
+        await storage.ensure_collection(db)
+    report = await (ensure_indexes(db) if apply else index_report(db))
+    for collection, status in report.items():
+        print(f"📚 {collection}")
+        print(f"   faltan: {', '.join(status['missing']) or '-'}")
+        print(f"   sobran: {', '.join(status['extra']) or '-'}")
+    if apply:
+        print("✅ Índices creados")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara los índices de MongoDB con los requeridos")
+    parser.add_argument("--apply", action="store_true", help="Crear los índices que faltan")
+    args = parser.parse_args()
+    asyncio.run(_main(args.apply))
@@ -1,19 +1,118 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Query
-from typing import Optional, List
-from datetime import datetime, timedelta
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Request
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from typing import Optional, List, Union
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from urllib.parse import urlencode
 from bson import ObjectId
+from contextlib import asynccontextmanager
+from pymongo.errors import BulkWriteError
+from pydantic import ValidationError
+import asyncio
+import base64
+import csv
+import hashlib
+import io
+import json
+import orjson
+import re
+import time
 
-from .db import get_db
-from .deps import get_current_user_id
-from .schemas import ExpenseCreate, ExpenseUpdate, ExpenseOut
+from .config import settings
+from .db import connect, close_client, get_client, get_db
+from .deps import get_current_user_oid
+from .schemas import (
+    ExpenseCreate, ExpenseUpdate, ExpenseOut, ExpensePage, ExpenseFields, ExpenseFieldsPage, ExpenseStats, ExpenseFilter,
+    BulkResult, BulkUpdate, BulkDelete, BulkUpdateResult, BulkDeleteResult, ExportJob,
+)
 from .models import Category
+from .utils import hash_pool_stats
+from . import exports, indexes, querylog, ranges, rollups, storage
+from .cache import response_cache
+from .compression import CompressionMiddleware
+from . import metrics
+from .metrics import MetricsMiddleware
+from .writer import InsertBatcher
 
-app = FastAPI(title="Expenses API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await connect()
+    db = get_client()[settings.MONGO_DB]
+    await storage.ensure_collection_safely(db)
+    if settings.ENSURE_INDEXES:
+        # En colecciones grandes la construcción puede tardar: no bloquear el arranque
+        if settings.INDEX_BUILD_BACKGROUND:
+            app.state.index_build = asyncio.create_task(indexes.ensure_indexes_safely(db))
+        else:
+            await indexes.ensure_indexes_safely(db)
+    await rollups.check_rollups_safely(db)
+    export_workers = exports.start_workers(db, settings.EXPORT_WORKERS)
+    metrics_flush = None
+    if settings.METRICS_ENABLED and settings.METRICS_DIR:
+        metrics_flush = asyncio.create_task(flush_metrics(settings.METRICS_DIR))
+    yield
+    if metrics_flush is not None:
+        metrics_flush.cancel()
+        await asyncio.gather(metrics_flush, return_exceptions=True)
+        metrics.remove_snapshot(settings.METRICS_DIR)
+    index_build = getattr(app.state, "index_build", None)
+    if index_build is not None and not index_build.done():
+        index_build.cancel()
+    if expense_writer is not None:
+        await expense_writer.close()
+    # Una exportación a medias vuelve a la cola antes de cerrar el cliente
+    for task in export_workers:
+        task.cancel()
+    await asyncio.gather(*export_workers, return_exceptions=True)
+    close_client()
+
+app = FastAPI(title="Expenses API", version="1.0.0", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+# Añadido al final: es el más externo y mide el tamaño ya comprimido
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
 # Routers
 from .auth import router as auth_router
 app.include_router(auth_router)
 
+@app.get("/health")
+async def health():
+    return {"status": "ok", "hash_pool": hash_pool_stats(), "cache": response_cache.stats()}
+
+def metric_gauges() -> list:
+    pool = hash_pool_stats()
+    cache = response_cache.stats()
+    extra = [
+        metrics.Gauge("hash_pool_workers", "Hilos del pool de bcrypt"),
+        metrics.Gauge("hash_pool_active", "Tareas de bcrypt en ejecución"),
+        metrics.Gauge("hash_pool_queued", "Tareas de bcrypt en cola"),
+        metrics.Gauge("hash_pool_failed_total", "Tareas de bcrypt terminadas con error", "counter"),
+        metrics.Gauge("hash_pool_rejected_total", "Tareas de bcrypt rechazadas por cola llena", "counter"),
+        metrics.Gauge("response_cache_hits_total", "Aciertos de la caché de lecturas", "counter"),
+        metrics.Gauge("response_cache_misses_total", "Fallos de la caché de lecturas", "counter"),
+    ]
+    for gauge, value in zip(extra, (pool["workers"], pool["active"], pool["queued"], pool["failed"], pool["rejected"], cache["hits"], cache["misses"])):
+        gauge.set(value)
+    return extra
+
+async def flush_metrics(directory: str):
+    # La petición de /metrics llega a un solo worker: los demás publican su instantánea aquí
+    while True:
+        metrics.write_snapshot(directory, metric_gauges())
+        await asyncio.sleep(settings.METRICS_FLUSH_SECONDS)
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    if settings.METRICS_DIR:
+        metrics.write_snapshot(settings.METRICS_DIR, metric_gauges())
+        body = metrics.render_workers(settings.METRICS_DIR, max_age=3 * settings.METRICS_FLUSH_SECONDS)
+    else:
+        body = metrics.render(metric_gauges())
+    return Response(body, media_type="text/plain; version=0.0.4")
+
 # Helpers
 
 def to_object_id(id_str: str) -> ObjectId:
@@ -22,51 +121,307 @@ def to_object_id(id_str: str) -> ObjectId:
     except Exception:
         raise HTTPException(status_code=400, detail="ID inválido")
 
-async def serialize_expense(doc) -> ExpenseOut:
-    return ExpenseOut(
+def expense_updates(payload: ExpenseUpdate) -> dict:
+    updates = {k: v for k, v in payload.model_dump(exclude_unset=True).items()}
+    if "category" in updates and updates["category"] is not None:
+        updates["category"] = updates["category"].value
+
+    if not updates:
+        raise HTTPException(status_code=400, detail="Nada que actualizar")
+    return updates
+
+def serialize_expense(doc) -> ExpenseOut:
+    # Los documentos vienen de nuestra colección: construcción sin revalidar
+    return ExpenseOut.model_construct(
         id=str(doc["_id"]),
         user_id=str(doc["user_id"]),
         amount=doc["amount"],
-        category=doc["category"],
+        category=Category(doc["category"]),
         description=doc.get("description"),
         date=doc["date"],
     )
 
+# Versión de los gastos de cada usuario, guardada en su documento de users para
+# que todos los workers la compartan. Cada escritura la incrementa; el ETag y la
+# clave de la caché de respuestas se derivan de ella.
+
+async def expenses_changed(db, user_id: ObjectId):
+    await db["users"].update_one(
+        {"_id": user_id},
+        {"$inc": {"expenses_version": 1}, "$currentDate": {"expenses_modified_at": True}},
+    )
+
+async def expenses_version(db, user_id: ObjectId) -> tuple[int, Optional[datetime]]:
+    user = await db["users"].find_one({"_id": user_id}, {"expenses_version": 1, "expenses_modified_at": 1})
+    user = user or {}
+    return user.get("expenses_version", 0), user.get("expenses_modified_at")
+
+def filter_variant(q: dict) -> str:
+    # Los rangos relativos (this_month, past_week...) cambian de límites con el
+    # reloj sin que cambie la URL: la variante los incluye ya resueltos
+    return repr(q.get("date", ""))
+
+def validators(request: Request, q: dict, version: int, modified_at: Optional[datetime]) -> dict:
+    query = urlencode(sorted(request.query_params.multi_items())) + filter_variant(q)
+    headers = {"ETag": f'W/"{version}-{hashlib.sha1(query.encode()).hexdigest()[:16]}"'}
+    if modified_at is not None:
+        headers["Last-Modified"] = format_datetime(modified_at.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+def not_modified(request: Request, headers: dict) -> bool:
+    # Solo If-None-Match: Last-Modified tiene resolución de segundos y dos
+    # escrituras en el mismo segundo darían un 304 incorrecto
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or headers["ETag"] in tags or headers["ETag"][2:] in tags
+
+# Órdenes del listado: campo y dirección, con _id como desempate. Cada uno
+# tiene su índice {user_id, [category,] campo, _id} en app/indexes.py
+SORTS = {
+    "-date": ("date", -1),
+    "date": ("date", 1),
+    "-amount": ("amount", -1),
+    "amount": ("amount", 1),
+}
+
+def expense_sort(
+    sort: str = Query(default="-date", description="-date | date | -amount | amount"),
+) -> str:
+    if sort not in SORTS:
+        raise HTTPException(status_code=400, detail="Orden inválido")
+    return sort
+
+def sort_spec(sort: str) -> list:
+    field, direction = SORTS[sort]
+    return [(field, direction), ("_id", direction)]
+
+# Paginación por cursor: el cursor codifica el orden y (valor, _id) de la última fila devuelta
+
+def encode_cursor(doc, sort: str = "-date") -> str:
+    field = SORTS[sort][0]
+    value = doc[field].isoformat() if field == "date" else doc[field]
+    raw = json.dumps({"s": sort, "v": value, "id": str(doc["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str, sort: str = "-date") -> tuple:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # Cursores emitidos antes de los órdenes: {"d": fecha, "id": ...}
+        if "d" in raw:
+            raw = {"s": "-date", "v": raw["d"], "id": raw["id"]}
+        if raw["s"] != sort:
+            raise ValueError(raw["s"])
+        value = datetime.fromisoformat(raw["v"]) if SORTS[sort][0] == "date" else float(raw["v"])
+        return value, ObjectId(raw["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def seek_filter(sort: str, value, last_id: ObjectId) -> list:
+    # Filas posteriores a (value, last_id) en el orden indicado
+    field, direction = SORTS[sort]
+    op = "$lt" if direction < 0 else "$gt"
+    return [
+        {field: {op: value}},
+        {field: value, "_id": {op: last_id}},
+    ]
+
 # CRUD Gastos
+async def expenses_inserted(db, docs: list[dict]):
+    # La versión se sube aunque fallen los totales: si no, la caché y los ETag
+    # seguirían ocultando los gastos ya guardados
+    try:
+        await rollups.apply_changes(db, added=docs)
+    finally:
+        for user_id in {doc["user_id"] for doc in docs}:
+            await expenses_changed(db, user_id)
+
+# Altas agrupadas en insert_many (INSERT_BATCH_ENABLED), para integraciones con muchas altas por segundo
+expense_writer = (
+    InsertBatcher("expenses", expenses_inserted, settings.INSERT_BATCH_MAX, settings.INSERT_BATCH_WINDOW_MS)
+    if settings.INSERT_BATCH_ENABLED else None
+)
+
 @app.post("/expenses", response_model=ExpenseOut, status_code=201)
-async def create_expense(payload: ExpenseCreate, db = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+async def create_expense(payload: ExpenseCreate, db = Depends(get_db), user_id: ObjectId = Depends(get_current_user_oid)):
     expenses = db["expenses"]
     doc = {
-        "user_id": ObjectId(user_id),
+        "user_id": user_id,
         "amount": payload.amount,
         "category": payload.category.value,
         "description": payload.description,
         "date": payload.date,
     }
+    if expense_writer is not None:
+        # Rollups y versión se actualizan al escribir el lote, antes de resolver
+        doc["_id"] = await expense_writer.insert(db, doc)
+        return serialize_expense(doc)
     res = await expenses.insert_one(doc)
     doc["_id"] = res.inserted_id
-    return await serialize_expense(doc)
+    await rollups.add_expense(db, doc)
+    await expenses_changed(db, user_id)
+    return serialize_expense(doc)
 
-@app.get("/expenses", response_model=List[ExpenseOut])
-async def list_expenses(
-    db = Depends(get_db),
-    user_id: str = Depends(get_current_user_id),
-    rango: Optional[str] = Query(default=None, description="past_week | past_month | last_3_months | custom"),
+BULK_CONTENT_TYPES = ("application/json", "application/x-ndjson", "text/csv")
+
+async def read_bulk_rows(request: Request) -> list:
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip()
+    if content_type not in BULK_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Formato no soportado: use JSON, NDJSON o CSV")
+
+    body = (await request.body()).decode("utf-8-sig")
+    try:
+        if content_type == "text/csv":
+            rows = list(csv.DictReader(io.StringIO(body)))
+        elif content_type == "application/x-ndjson":
+            rows = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            rows = json.loads(body)
+    except (ValueError, csv.Error):
+        raise HTTPException(status_code=400, detail="Cuerpo mal formado")
+
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Se esperaba una lista de gastos")
+    return rows
+
+@app.post("/expenses/bulk", response_model=BulkResult)
+async def bulk_create_expenses(request: Request, db = Depends(get_db), user_id: ObjectId = Depends(get_current_user_oid)):
+    rows = await read_bulk_rows(request)
+    if len(rows) > settings.BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Máximo {settings.BULK_MAX_ROWS} gastos por petición")
+
+    # Validación en una pasada: las filas inválidas se reportan, el resto se inserta
+    errors = []
+    docs = []
+    rows_of_docs = []
+    for i, row in enumerate(rows):
+        if isinstance(row, dict) and not row.get("description"):
+            row.pop("description", None)
+        try:
+            payload = ExpenseCreate.model_validate(row)
+        except ValidationError as e:
+            detail = "; ".join(
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" if err["loc"] else err["msg"]
+                for err in e.errors()
+            )
+            errors.append({"row": i, "detail": detail})
+            continue
+        docs.append({
+            "user_id": user_id,
+            "amount": payload.amount,
+            "category": payload.category.value,
+            "description": payload.description,
+            "date": payload.date,
+        })
+        rows_of_docs.append(i)
+
+    expenses = db["expenses"]
+    inserted = []
+    chunk_size = settings.BULK_CHUNK_SIZE
+    for start in range(0, len(docs), chunk_size):
+        chunk = docs[start:start + chunk_size]
+        failed = set()
+        try:
+            await expenses.insert_many(chunk, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                failed.add(err["index"])
+                errors.append({"row": rows_of_docs[start + err["index"]], "detail": err.get("errmsg", "Error de escritura")})
+        inserted.extend(doc for j, doc in enumerate(chunk) if j not in failed)
+
+    await rollups.apply_changes(db, added=inserted)
+    await expenses_changed(db, user_id)
+    errors.sort(key=lambda err: err["row"])
+    return BulkResult(inserted=len(inserted), errors=errors)
+
+# Campos que afectan a los totales de expense_rollups
+ROLLUP_FIELDS = {"amount", "category", "date"}
+
+def filter_query(user_id: ObjectId, flt: ExpenseFilter) -> dict:
+    if flt.category is None and flt.start_date is None and flt.end_date is None:
+        raise HTTPException(status_code=400, detail="El filtro no puede estar vacío")
+    q = {"user_id": user_id}
+    if flt.category:
+        q["category"] = flt.category.value
+    if flt.start_date or flt.end_date:
+        q["date"] = {}
+        if flt.start_date:
+            q["date"]["$gte"] = flt.start_date
+        if flt.end_date:
+            q["date"]["$lte"] = flt.end_date
+    return q
+
+@app.patch("/expenses/bulk", response_model=BulkUpdateResult)
+async def bulk_update_expenses(payload: BulkUpdate, db = Depends(get_db), user_id: ObjectId = Depends(get_current_user_oid)):
+    if (payload.items is None) == (payload.filter is None):
+        raise HTTPException(status_code=400, detail="Indique 'items' o 'filter', no ambos")
+
+    if payload.items is not None:
+        if len(payload.items) > settings.BULK_MAX_ROWS:
+            raise HTTPException(status_code=413, detail=f"Máximo {settings.BULK_MAX_ROWS} gastos por petición")
+        changes = {to_object_id(item.id): expense_updates(item.changes) for item in payload.items}
+        if not changes:
+            return BulkUpdateResult(matched=0, modified=0)
+        q = {"_id": {"$in": list(changes)}, "user_id": user_id}
+        changed = set().union(*changes.values())
+    else:
+        if payload.changes is None:
+            raise HTTPException(status_code=400, detail="Nada que actualizar")
+        changes = {None: expense_updates(payload.changes)}
+        q = filter_query(user_id, payload.filter)
+        changed = set(changes[None])
+
+    # El estado previo solo hace falta si cambian los totales
+    matched, modified, old, new = await storage.update_expenses(db, q, changes, load_old=bool(ROLLUP_FIELDS & changed))
+    await rollups.apply_changes(db, removed=old, added=new)
+    await expenses_changed(db, user_id)
+    return BulkUpdateResult(matched=matched, modified=modified)
+
+@app.delete("/expenses/bulk", response_model=BulkDeleteResult)
+async def bulk_delete_expenses(payload: BulkDelete, db = Depends(get_db), user_id: ObjectId = Depends(get_current_user_oid)):
+    if (payload.ids is None) == (payload.filter is None):
+        raise HTTPException(status_code=400, detail="Indique 'ids' o 'filter', no ambos")
+
+    if payload.ids is not None:
+        q = {"_id": {"$in": [to_object_id(i) for i in payload.ids]}, "user_id": user_id}
+    else:
+        q = filter_query(user_id, payload.filter)
+
+    # Una fila por gasto: en time-series delete_many borra también sus versiones antiguas
+    old = await storage.find_expenses(db, q, storage.ROLLUP_PROJECTION).to_list(length=None)
+    if not old:
+        return BulkDeleteResult(deleted=0)
+    res = await db["expenses"].delete_many({"_id": {"$in": [doc["_id"] for doc in old]}, "user_id": user_id})
+    await rollups.apply_changes(db, removed=old)
+    await expenses_changed(db, user_id)
+    return BulkDeleteResult(deleted=len(old) if storage.timeseries() else res.deleted_count)
+
+def expense_query(
+    user_id: ObjectId = Depends(get_current_user_oid),
+    rango: Optional[str] = Query(
+        default=None,
+        description="past_week | past_month | last_3_months | this_week | last_week | iso_week | this_month | last_month | ytd | custom",
+    ),
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    category: Optional[Category] = Query(default=None),
-):
-    expenses = db["expenses"]
-    q = {"user_id": ObjectId(user_id)}
+    category: Optional[List[Category]] = Query(default=None, description="Una o varias categorías: category=ropa&category=salud"),
+    min_amount: Optional[float] = Query(default=None, ge=0, description="Importe mínimo (incluido)"),
+    max_amount: Optional[float] = Query(default=None, ge=0, description="Importe máximo (incluido)"),
+    tz: Optional[str] = Query(default=None, description="Zona horaria IANA de los rangos de calendario (p. ej. Europe/Madrid)"),
+    week: Optional[str] = Query(default=None, description="Semana ISO para rango=iso_week (p. ej. 2025-W07)"),
+    search: Optional[str] = Query(default=None, alias="q", max_length=200, description="Palabras a buscar en la descripción"),
+) -> dict:
+    q = {"user_id": user_id}
 
-    # Filtros de fecha
+    # Filtros de fecha, con límites estables: [inicio, fin)
     now = datetime.utcnow()
-    if rango == "past_week":
-        q["date"] = {"$gte": now - timedelta(days=7), "$lte": now}
-    elif rango == "past_month":
-        q["date"] = {"$gte": now - timedelta(days=30), "$lte": now}
-    elif rango == "last_3_months":
-        q["date"] = {"$gte": now - timedelta(days=90), "$lte": now}
+    if rango in ranges.ROLLING_DAYS:
+        start, end = ranges.rolling_range(rango, now)
+        q["date"] = {"$gte": start, "$lt": end}
+    elif rango in ranges.CALENDAR_RANGES:
+        start, end = ranges.calendar_range(rango, ranges.parse_timezone(tz), now, week)
+        q["date"] = {"$gte": start, "$lt": end}
     elif rango == "custom":
         if not start_date or not end_date:
             raise HTTPException(status_code=400, detail="Para 'custom' debe indicar start_date y end_date")
@@ -74,38 +429,309 @@ async def list_expenses(
 
     # Filtro por categoría
     if category:
-        q["category"] = category.value
+        values = list(dict.fromkeys(cat.value for cat in category))
+        q["category"] = values[0] if len(values) == 1 else {"$in": values}
 
-    cursor = expenses.find(q).sort("date", -1)
-    results = [await serialize_expense(doc) async for doc in cursor]
-    return results
+    # Filtro por importe
+    if min_amount is not None and max_amount is not None and min_amount > max_amount:
+        raise HTTPException(status_code=400, detail="min_amount no puede ser mayor que max_amount")
+    if min_amount is not None or max_amount is not None:
+        q["amount"] = {}
+        if min_amount is not None:
+            q["amount"]["$gte"] = min_amount
+        if max_amount is not None:
+            q["amount"]["$lte"] = max_amount
 
-@app.patch("/expenses/{expense_id}", response_model=ExpenseOut)
-async def update_expense(expense_id: str, payload: ExpenseUpdate, db = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+    # Búsqueda en la descripción con el índice de texto
+    if search is not None:
+        if not re.search(r"\w", search):
+            raise HTTPException(status_code=400, detail="La búsqueda debe contener alguna palabra")
+        q.update(storage.text_filter(search))
+
+    return q
+
+# Serialización directa a dict (orjson codifica datetime), sin construir ExpenseOut
+EXPENSE_FIELDS = {
+    "id": lambda doc: str(doc["_id"]),
+    "user_id": lambda doc: str(doc["user_id"]),
+    "amount": lambda doc: doc["amount"],
+    "category": lambda doc: doc["category"],
+    "description": lambda doc: doc.get("description"),
+    "date": lambda doc: doc["date"],
+}
+
+def expense_row(doc, fields: Optional[list[str]] = None) -> dict:
+    if fields is None:
+        return {
+            "id": str(doc["_id"]),
+            "user_id": str(doc["user_id"]),
+            "amount": doc["amount"],
+            "category": doc["category"],
+            "description": doc.get("description"),
+            "date": doc["date"],
+        }
+    return {field: EXPENSE_FIELDS[field](doc) for field in fields}
+
+def expense_fields(
+    fields: Optional[str] = Query(default=None, description="Campos a devolver separados por coma, p. ej. amount,date"),
+) -> Optional[list[str]]:
+    if fields is None:
+        return None
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    invalid = [field for field in selected if field not in EXPENSE_FIELDS]
+    if invalid or not selected:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(invalid) or fields}")
+    return list(dict.fromkeys(selected))
+
+def expense_projection(fields: Optional[list[str]], sort: str = "-date") -> Optional[dict]:
+    # _id y el campo de orden siempre: los necesita el cursor
+    if fields is None:
+        return None
+    projection = {field: 1 for field in fields if field != "id"}
+    projection[SORTS[sort][0]] = 1
+    return projection
+
+@app.get("/expenses", response_model=Union[List[ExpenseOut], ExpensePage, List[ExpenseFields], ExpenseFieldsPage])
+async def list_expenses(
+    request: Request,
+    db = Depends(get_db),
+    q: dict = Depends(expense_query),
+    limit: Optional[int] = Query(default=None, ge=1, le=500, description="Tamaño de página; activa la paginación por cursor"),
+    cursor: Optional[str] = Query(default=None, description="Valor next_cursor de la página anterior"),
+    fields: Optional[list[str]] = Depends(expense_fields),
+    sort: str = Depends(expense_sort),
+):
+    # Petición condicional: se resuelve con el documento del usuario, sin leer expenses
+    version, modified_at = await expenses_version(db, q["user_id"])
+    headers = validators(request, q, version, modified_at)
+    if not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    key = response_cache.key("expenses", q["user_id"], version, request, filter_variant(q))
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return Response(cached, media_type="application/json", headers=headers)
+
+    projection = expense_projection(fields, sort)
+    order = sort_spec(sort)
+    # explain() solo está disponible para find (almacenamiento por documentos)
+    explainable = not storage.timeseries()
+
+    # Respuesta directa: evita la revalidación contra response_model
+    start = time.perf_counter()
+    if limit is None and cursor is None:
+        make_cursor = lambda: storage.find_expenses(db, q, projection, order)
+        docs = await make_cursor().to_list(length=None)
+        querylog.log_if_slow(make_cursor if explainable else None, q, time.perf_counter() - start, len(docs))
+        response = ORJSONResponse([expense_row(doc, fields) for doc in docs])
+    else:
+        # Seek sobre el índice del orden ({user_id, date, _id}...): sin skip, coste constante por página
+        limit = limit or 50
+        if cursor:
+            q["$or"] = seek_filter(sort, *decode_cursor(cursor, sort))
+
+        make_cursor = lambda: storage.find_expenses(db, q, projection, order, limit + 1)
+        docs = await make_cursor().to_list(length=limit + 1)
+        querylog.log_if_slow(make_cursor if explainable else None, q, time.perf_counter() - start, len(docs))
+        next_cursor = encode_cursor(docs[limit - 1], sort) if len(docs) > limit else None
+        response = ORJSONResponse({"items": [expense_row(doc, fields) for doc in docs[:limit]], "next_cursor": next_cursor})
+
+    await response_cache.set(key, response.body)
+    response.headers.update(headers)
+    return response
+
+@app.get("/expenses/stream")
+async def stream_expenses(
+    db = Depends(get_db),
+    q: dict = Depends(expense_query),
+    fields: Optional[list[str]] = Depends(expense_fields),
+    sort: str = Depends(expense_sort),
+):
+    docs = storage.find_expenses(db, q, expense_projection(fields, sort), sort_spec(sort), batch_size=settings.STREAM_BATCH_SIZE)
+
+    # NDJSON sin pasar por ExpenseOut: una línea por gasto, enviadas por lotes
+    async def ndjson():
+        lines = []
+        async for doc in docs:
+            lines.append(orjson.dumps(expense_row(doc, fields)))
+            if len(lines) >= settings.STREAM_BATCH_SIZE:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+def serialize_export(job: dict) -> ExportJob:
+    return ExportJob(
+        id=str(job["_id"]),
+        status=job["status"],
+        format=job["format"],
+        rows=job["rows"],
+        size=job.get("size"),
+        error=job.get("error"),
+        created_at=job["created_at"],
+        finished_at=job.get("finished_at"),
+        download_url=f"/expenses/exports/{job['_id']}/download" if job["status"] == "done" else None,
+    )
+
+async def find_export(db, user_id: ObjectId, export_id: str) -> dict:
+    job = await db[exports.EXPORTS].find_one({"_id": to_object_id(export_id), "user_id": user_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Exportación no encontrada")
+    return job
+
+@app.post("/expenses/exports", response_model=ExportJob, status_code=202)
+async def create_export(
+    response: Response,
+    db = Depends(get_db),
+    q: dict = Depends(expense_query),
+    fmt: str = Query(default="csv", alias="format", description="csv | parquet"),
+):
+    formats = exports.available_formats()
+    if fmt not in formats:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: use {' o '.join(formats)}")
+    if await exports.active_jobs(db, q["user_id"]) >= settings.EXPORT_MAX_ACTIVE:
+        raise HTTPException(status_code=429, detail="Demasiadas exportaciones en curso")
+    job = await exports.enqueue(db, q["user_id"], q, fmt)
+    response.headers["Location"] = f"/expenses/exports/{job['_id']}"
+    return serialize_export(job)
+
+@app.get("/expenses/exports/{export_id}", response_model=ExportJob)
+async def get_export(export_id: str, db = Depends(get_db), user_id: ObjectId = Depends(get_current_user_oid)):
+    return serialize_export(await find_export(db, user_id, export_id))
+
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+@app.get("/expenses/exports/{export_id}/download")
+async def download_export(export_id: str, db = Depends(get_db), user_id: ObjectId = Depends(get_current_user_oid)):
+    job = await find_export(db, user_id, export_id)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"La exportación no está lista ({job['status']})")
+    path = exports.export_path(job["_id"], job["format"])
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="El fichero de la exportación ya no existe")
+    filename = f"gastos-{job['created_at']:%Y%m%d-%H%M%S}.{job['format']}"
+    return FileResponse(path, media_type=EXPORT_MEDIA_TYPES[job["format"]], filename=filename)
+
+# Filtros que se pueden resolver con expense_rollups
+ROLLUP_FILTERS = {"user_id", "category", "date"}
+
+# Formato de $dateToString para cada tamaño de periodo
+PERIOD_FORMATS = {
+    "day": "%Y-%m-%d",
+    "week": "%G-W%V",
+    "month": "%Y-%m",
+}
+
+async def rollup_stats(db, q: dict, period: Optional[str]) -> ExpenseStats:
+    match = {**q, "count": {"$gt": 0}}
+    rows = await db[rollups.ROLLUPS].find(match, {"_id": 0, "year_month": 1, "category": 1, "total": 1, "count": 1}).to_list(length=None)
+
+    by_category: dict = {}
+    by_month: dict = {}
+    for row in rows:
+        cat = by_category.setdefault(row["category"], {"category": row["category"], "total": 0.0, "count": 0})
+        cat["total"] += row["total"]
+        cat["count"] += row["count"]
+        month = by_month.setdefault(row["year_month"], {"period": row["year_month"], "total": 0.0, "count": 0})
+        month["total"] += row["total"]
+        month["count"] += row["count"]
+
+    categories = sorted(by_category.values(), key=lambda row: row["total"], reverse=True)
+    return ExpenseStats(
+        total=sum(row["total"] for row in categories),
+        count=sum(row["count"] for row in categories),
+        by_category=categories,
+        by_period=[by_month[key] for key in sorted(by_month)] if period else None,
+    )
+
+@app.get("/expenses/stats", response_model=ExpenseStats)
+async def expense_stats(
+    request: Request,
+    db = Depends(get_db),
+    q: dict = Depends(expense_query),
+    period: Optional[str] = Query(default=None, description="day | week | month"),
+    tz: Optional[str] = Query(default=None, description="Zona horaria IANA de los periodos"),
+):
+    if period is not None and period not in PERIOD_FORMATS:
+        raise HTTPException(status_code=400, detail="Periodo inválido")
+    zone = ranges.parse_timezone(tz).key
+
+    version, _ = await expenses_version(db, q["user_id"])
+    key = response_cache.key("stats", q["user_id"], version, request, filter_variant(q))
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return Response(cached, media_type="application/json")
+
+    stats = await compute_stats(db, q, period, zone)
+    response = ORJSONResponse(stats.model_dump(mode="json"))
+    await response_cache.set(key, response.body)
+    return response
+
+async def compute_stats(db, q: dict, period: Optional[str], zone: str = "UTC") -> ExpenseStats:
+    # Los totales mensuales precalculados (meses UTC) bastan sin filtro de fecha o
+    # con uno que cubre meses completos (this_month, last_month en UTC): O(meses).
+    # Una búsqueda por descripción necesita los gastos.
+    if set(q) <= ROLLUP_FILTERS and period in (None, "month") and (period is None or zone == "UTC"):
+        if "date" not in q:
+            return await rollup_stats(db, q, period)
+        months = ranges.utc_month_range(q["date"])
+        if months is not None:
+            rollup_q = {key: value for key, value in q.items() if key != "date"}
+            rollup_q["year_month"] = {"$gte": months[0], "$lt": months[1]}
+            return await rollup_stats(db, rollup_q, period)
     expenses = db["expenses"]
-    oid = to_object_id(expense_id)
 
-    updates = {k: v for k, v in payload.model_dump(exclude_unset=True).items()}
-    if "category" in updates and updates["category"] is not None:
-        updates["category"] = updates["category"].value
+    by_category = await expenses.aggregate([
+        *storage.match_stages(q),
+        {"$group": {"_id": "$category", "total": {"$sum": "$amount"}, "count": {"$sum": 1}}},
+        {"$sort": {"total": -1}},
+    ]).to_list(length=None)
 
-    if not updates:
-        raise HTTPException(status_code=400, detail="Nada que actualizar")
+    by_period = None
+    if period:
+        # Sin zona explícita $dateToString agrupa en UTC
+        date_format = {"format": PERIOD_FORMATS[period], "date": "$date"}
+        if zone != "UTC":
+            date_format["timezone"] = zone
+        by_period = await expenses.aggregate([
+            *storage.match_stages(q),
+            {"$group": {
+                "_id": {"$dateToString": date_format},
+                "total": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"_id": 1}},
+        ]).to_list(length=None)
+        by_period = [{"period": row["_id"], "total": row["total"], "count": row["count"]} for row in by_period]
 
-    res = await expenses.find_one_and_update(
-        {"_id": oid, "user_id": ObjectId(user_id)},
-        {"$set": updates},
-        return_document=True,
+    return ExpenseStats(
+        total=sum(row["total"] for row in by_category),
+        count=sum(row["count"] for row in by_category),
+        by_category=[{"category": row["_id"], "total": row["total"], "count": row["count"]} for row in by_category],
+        by_period=by_period,
     )
-    if not res:
+
+@app.patch("/expenses/{expense_id}", response_model=ExpenseOut)
+async def update_expense(expense_id: str, payload: ExpenseUpdate, db = Depends(get_db), user_id: ObjectId = Depends(get_current_user_oid)):
+    oid = to_object_id(expense_id)
+    updates = expense_updates(payload)
+
+    old = await storage.update_expense(db, user_id, oid, updates)
+    if not old:
         raise HTTPException(status_code=404, detail="Gasto no encontrado")
-    return await serialize_expense(res)
+    res = {**old, **updates}
+    await rollups.move_expense(db, old, res)
+    await expenses_changed(db, user_id)
+    return serialize_expense(res)
 
 @app.delete("/expenses/{expense_id}", status_code=204)
-async def delete_expense(expense_id: str, db = Depends(get_db), user_id: str = Depends(get_current_user_id)):
-    expenses = db["expenses"]
+async def delete_expense(expense_id: str, db = Depends(get_db), user_id: ObjectId = Depends(get_current_user_oid)):
     oid = to_object_id(expense_id)
-    res = await expenses.delete_one({"_id": oid, "user_id": ObjectId(user_id)})
-    if res.deleted_count == 0:
+    res = await storage.delete_expense(db, user_id, oid)
+    if not res:
         raise HTTPException(status_code=404, detail="Gasto no encontrado")
+    await rollups.remove_expense(db, res)
+    await expenses_changed(db, user_id)
     return
\ No newline at end of file
@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from pathlib import Path
+import orjson
+from contextvars import ContextVar
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+
+# Métricas en formato de texto de Prometheus, por proceso.
+# Los eventos de MongoDB llegan desde hilos del driver: todo acceso va con lock.
+# Con varios workers cada uno vuelca su instantánea en METRICS_DIR y /metrics
+# sirve la de todos, con la etiqueta worker.
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series: dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for values, (counts, total, count) in sorted(self.series.items()):
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), values + (bound,))} {bucket}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), values + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, values)} {count}")
+        return lines
+
+class Gauge:
+    def __init__(self, name: str, help: str, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.value}"]
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Duración de las peticiones HTTP", ("method", "route", "status"))
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Tamaño del cuerpo de las respuestas", ("route",), SIZE_BUCKETS)
+IN_FLIGHT = Gauge("http_requests_in_flight", "Peticiones HTTP en curso")
+MONGO_DURATION = Histogram("mongo_command_duration_seconds", "Duración de los comandos de MongoDB", ("command", "outcome"))
+INSERT_BATCH_SIZE = Histogram("expense_insert_batch_size", "Gastos por insert_many del escritor agrupado", (), (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+BCRYPT_DURATION = Histogram("bcrypt_duration_seconds", "Duración del hashing/verificación bcrypt (incluye cola)", ("operation",))
+
+# Tiempos acumulados de la petición en curso, para la cabecera Server-Timing.
+# Motor copia el contexto al ejecutar en sus hilos, así que el listener lo ve.
+request_timings: ContextVar[dict | None] = ContextVar("request_timings", default=None)
+
+def add_timing(name: str, seconds: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_DURATION.observe(seconds, event.command_name, "ok")
+        add_timing("mongo", seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_DURATION.observe(seconds, event.command_name, "error")
+        add_timing("mongo", seconds)
+
+def server_timing(timings: dict, total: float) -> str:
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    parts.append(f"app;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings: dict = {}
+        token = request_timings.set(timings)
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(raw=message["headers"])
+                headers.append("Server-Timing", server_timing(timings, time.perf_counter() - start))
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.inc(-1)
+            request_timings.reset(token)
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            REQUEST_DURATION.observe(time.perf_counter() - start, scope["method"], path, status)
+            RESPONSE_SIZE.observe(size, path)
+
+def snapshot(extra: list[Gauge] = ()) -> dict:
+    families = {}
+    for metric in (REQUEST_DURATION, RESPONSE_SIZE, IN_FLIGHT, MONGO_DURATION, BCRYPT_DURATION, INSERT_BATCH_SIZE, *extra):
+        lines = metric.render()
+        families[metric.name] = {"header": lines[:2], "samples": lines[2:]}
+    return families
+
+def render_families(families: dict) -> str:
+    lines = []
+    for family in families.values():
+        lines.extend(family["header"])
+        lines.extend(family["samples"])
+    return "\n".join(lines) + "\n"
+
+def render(extra: list[Gauge] = ()) -> str:
+    return render_families(snapshot(extra))
+
+def _with_worker(sample: str, worker: str) -> str:
+    name, _, value = sample.rpartition(" ")
+    label = f'worker="{worker}"'
+    if name.endswith("}"):
+        return f"{name[:-1]},{label}}} {value}"
+    return f"{name}{{{label}}} {value}"
+
+def snapshot_path(directory: str) -> Path:
+    return Path(directory) / f"{os.getpid()}.json"
+
+def write_snapshot(directory: str, extra: list[Gauge] = ()):
+    worker = str(os.getpid())
+    families = snapshot(extra)
+    for family in families.values():
+        family["samples"] = [_with_worker(sample, worker) for sample in family["samples"]]
+    # Escritura atómica: otro worker puede estar leyendo el fichero
+    path = snapshot_path(directory)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(orjson.dumps(families))
+    os.replace(tmp, path)
+
+def remove_snapshot(directory: str):
+    snapshot_path(directory).unlink(missing_ok=True)
+
+def render_workers(directory: str, max_age: float) -> str:
+    """Une las instantáneas de todos los workers; ignora las de workers muertos"""
+    merged: dict = {}
+    now = time.time()
+    for path in sorted(Path(directory).glob("*.json")):
+        try:
+            if now - path.stat().st_mtime > max_age:
+                continue
+            families = orjson.loads(path.read_bytes())
+        except (OSError, ValueError):
+            continue
+        for name, family in families.items():
+            target = merged.setdefault(name, {"header": family["header"], "samples": []})
+            target["samples"].extend(family["samples"])
+    return render_families(merged)
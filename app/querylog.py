@@ -0,0 +1,60 @@
+import asyncio
+import json
+import logging
+from pymongo.errors import PyMongoError
+from .config import settings
+
+logger = logging.getLogger("app.slow_queries")
+
+# Tareas de explain en curso: se guarda la referencia para que no se recolecten
+_pending: set[asyncio.Task] = set()
+
+def plan_summary(plan: dict) -> str:
+    # FETCH > IXSCAN(user_id_1_date_-1__id_-1), COLLSCAN, ...
+    plan = plan.get("queryPlan", plan)
+    stage = plan.get("stage", "?")
+    if plan.get("indexName"):
+        stage += f"({plan['indexName']})"
+    children = plan.get("inputStages") or ([plan["inputStage"]] if "inputStage" in plan else [])
+    if not children:
+        return stage
+    return stage + " > " + ", ".join(plan_summary(child) for child in children)
+
+def describe(q: dict) -> str:
+    return json.dumps(q, default=str, ensure_ascii=False)
+
+async def explain_and_log(make_cursor, q: dict, elapsed_ms: float, returned: int):
+    try:
+        result = await make_cursor().explain()
+    except PyMongoError:
+        logger.exception("No se pudo obtener el plan de %s", describe(q))
+        return
+    stats = result.get("executionStats", {})
+    logger.warning(
+        "Consulta lenta en expenses: %.1f ms, %d devueltos, %s docs / %s claves examinados, plan %s, filtro %s",
+        elapsed_ms,
+        returned,
+        stats.get("totalDocsExamined", "?"),
+        stats.get("totalKeysExamined", "?"),
+        plan_summary(result.get("queryPlanner", {}).get("winningPlan", {})),
+        describe(q),
+    )
+
+def log_if_slow(make_cursor, q: dict, elapsed: float, returned: int):
+    # elapsed: solo la ida y vuelta del cursor, sin construir ni serializar la respuesta.
+    # make_cursor crea un cursor equivalente para explain(); None: la consulta no lo
+    # admite y se registra sin plan
+    elapsed_ms = elapsed * 1000
+    if settings.SLOW_QUERY_MS <= 0 or elapsed_ms < settings.SLOW_QUERY_MS:
+        return
+    if make_cursor is None:
+        reason = "explain no disponible"
+    elif len(_pending) >= settings.SLOW_QUERY_EXPLAIN_CONCURRENCY:
+        # Con la base saturada, un explain por consulta lenta la saturaría más
+        reason = f"explain omitido, {len(_pending)} en curso"
+    else:
+        task = asyncio.create_task(explain_and_log(make_cursor, q, elapsed_ms, returned))
+        _pending.add(task)
+        task.add_done_callback(_pending.discard)
+        return
+    logger.warning("Consulta lenta en expenses: %.1f ms, %d devueltos (%s), filtro %s", elapsed_ms, returned, reason, describe(q))
@@ -0,0 +1,76 @@
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from fastapi import HTTPException
+from .config import settings
+
+# Límites de fecha de los filtros por rango. Todos caen en fronteras estables
+# (minuto, día, semana, mes) para que la misma consulta produzca el mismo filtro
+# durante todo el periodo y la caché, los ETag y los rollups puedan reutilizarlo.
+# MongoDB guarda UTC sin zona: los límites se devuelven igual.
+
+ROLLING_DAYS = {"past_week": 7, "past_month": 30, "last_3_months": 90}
+CALENDAR_RANGES = {"this_week", "last_week", "iso_week", "this_month", "last_month", "ytd"}
+
+def parse_timezone(name: str | None) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or settings.DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail="Zona horaria inválida")
+
+def parse_week(week: str | None) -> date:
+    # Semana ISO en formato 2025-W07
+    try:
+        year, number = week.upper().split("-W")
+        return date.fromisocalendar(int(year), int(number), 1)
+    except (AttributeError, ValueError):
+        raise HTTPException(status_code=400, detail="Semana inválida: use el formato AAAA-Www (p. ej. 2025-W07)")
+
+def add_months(day: date, months: int) -> date:
+    years, month = divmod(day.month - 1 + months, 12)
+    return date(day.year + years, month + 1, 1)
+
+def local_midnight_utc(day: date, tz: ZoneInfo) -> datetime:
+    return datetime.combine(day, time(), tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+def rolling_range(rango: str, now: datetime) -> tuple[datetime, datetime]:
+    # Fin en el siguiente minuto: el filtro se repite durante un minuto e incluye lo recién creado
+    end = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    return end - timedelta(days=ROLLING_DAYS[rango]), end
+
+@lru_cache(maxsize=1024)
+def _calendar_range(rango: str, tz: ZoneInfo, today: date, week: date | None) -> tuple[datetime, datetime]:
+    if rango == "this_month":
+        start = today.replace(day=1)
+        end = add_months(start, 1)
+    elif rango == "last_month":
+        end = today.replace(day=1)
+        start = add_months(end, -1)
+    elif rango == "ytd":
+        start = date(today.year, 1, 1)
+        end = today + timedelta(days=1)
+    elif rango == "this_week":
+        start = today - timedelta(days=today.weekday())
+        end = start + timedelta(days=7)
+    elif rango == "last_week":
+        end = today - timedelta(days=today.weekday())
+        start = end - timedelta(days=7)
+    else:
+        start = week
+        end = start + timedelta(days=7)
+    return local_midnight_utc(start, tz), local_midnight_utc(end, tz)
+
+def calendar_range(rango: str, tz: ZoneInfo, now: datetime, week: str | None = None) -> tuple[datetime, datetime]:
+    """Intervalo [inicio, fin) del periodo de calendario que contiene `now` (UTC) en la zona `tz`."""
+    today = now.replace(tzinfo=timezone.utc).astimezone(tz).date()
+    return _calendar_range(rango, tz, today, parse_week(week) if rango == "iso_week" else None)
+
+def utc_month_range(bounds: dict) -> tuple[str, str] | None:
+    # ("2025-01", "2025-04") si el filtro [inicio, fin) cubre meses UTC completos
+    start, end = bounds.get("$gte"), bounds.get("$lt")
+    if start is None or end is None or set(bounds) != {"$gte", "$lt"}:
+        return None
+    for value in (start, end):
+        if value.tzinfo is not None or (value.day, value.hour, value.minute, value.second, value.microsecond) != (1, 0, 0, 0, 0):
+            return None
+    return start.strftime("%Y-%m"), end.strftime("%Y-%m")
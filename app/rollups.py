@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from . import indexes, storage
+
+# Totales mensuales por (user_id, year_month, category), mantenidos con $inc
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS = "expense_rollups"
+
+def year_month(date: datetime) -> str:
+    # MongoDB guarda las fechas en UTC; el bucket debe coincidir con ese valor
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    return date.strftime("%Y-%m")
+
+async def inc_rollup(db, user_id: ObjectId, date: datetime, category: str, amount: float, count: int):
+    await db[ROLLUPS].update_one(
+        {"user_id": user_id, "year_month": year_month(date), "category": category},
+        {"$inc": {"total": amount, "count": count}},
+        upsert=True,
+    )
+
+async def add_expense(db, doc: dict):
+    await inc_rollup(db, doc["user_id"], doc["date"], doc["category"], doc["amount"], 1)
+
+async def apply_changes(db, removed: list[dict] = (), added: list[dict] = ()):
+    # Un único bulk_write con el delta neto de cada bucket
+    buckets: dict = {}
+    for docs, sign in ((removed, -1), (added, 1)):
+        for doc in docs:
+            key = (doc["user_id"], year_month(doc["date"]), doc["category"])
+            total, count = buckets.get(key, (0.0, 0))
+            buckets[key] = (total + sign * doc["amount"], count + sign)
+    ops = [
+        UpdateOne(
+            {"user_id": user_id, "year_month": month, "category": category},
+            {"$inc": {"total": total, "count": count}},
+            upsert=True,
+        )
+        for (user_id, month, category), (total, count) in buckets.items()
+        if total or count
+    ]
+    if ops:
+        await db[ROLLUPS].bulk_write(ops, ordered=False)
+
+async def remove_expense(db, doc: dict):
+    await inc_rollup(db, doc["user_id"], doc["date"], doc["category"], -doc["amount"], -1)
+
+async def move_expense(db, old: dict, new: dict):
+    same_bucket = (
+        year_month(old["date"]) == year_month(new["date"])
+        and old["category"] == new["category"]
+    )
+    if same_bucket:
+        if new["amount"] != old["amount"]:
+            await inc_rollup(db, new["user_id"], new["date"], new["category"], new["amount"] - old["amount"], 0)
+        return
+    await remove_expense(db, old)
+    await add_expense(db, new)
+
+async def rebuild_rollups(db, user_id: ObjectId | None = None):
+    match = {"user_id": user_id} if user_id else {}
+    await db[ROLLUPS].delete_many(match)
+    await db[storage.EXPENSES].aggregate([
+        *storage.match_stages(match),
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "year_month": {"$dateToString": {"format": "%Y-%m", "date": "$date"}},
+                "category": "$category",
+            },
+            "total": {"$sum": "$amount"},
+            "count": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "year_month": "$_id.year_month",
+            "category": "$_id.category",
+            "total": 1,
+            "count": 1,
+        }},
+        {"$merge": {"into": ROLLUPS, "on": ["user_id", "year_month", "category"], "whenMatched": "replace"}},
+    ], allowDiskUse=True).to_list(length=None)
+
+async def ensure_rollups_index(db):
+    # $merge necesita un índice único sobre los campos de "on"
+    await db[ROLLUPS].create_indexes(indexes.required_indexes(ROLLUPS))
+
+async def rollups_missing(db) -> bool:
+    """expense_rollups vacía con gastos existentes: despliegue anterior sin migrar"""
+    if await db[ROLLUPS].find_one({}, {"_id": 1}) is not None:
+        return False
+    return await db[storage.EXPENSES].find_one({}, {"_id": 1}) is not None
+
+async def check_rollups_safely(db):
+    # No se reconstruye aquí: con otros workers escribiendo, los $inc aplicados
+    # durante la reconstrucción se perderían al hacer $merge
+    try:
+        if await rollups_missing(db):
+            logger.warning("%s está vacía pero hay gastos: /expenses/stats devolverá ceros hasta ejecutar make rebuild-rollups", ROLLUPS)
+    except PyMongoError:
+        logger.exception("No se pudo comprobar %s", ROLLUPS)
+
+async def _main(user_id: str | None):
+    from .db import get_client
+    from .config import settings
+
+    db = get_client()[settings.MONGO_DB]
+    await ensure_rollups_index(db)
+    await rebuild_rollups(db, ObjectId(user_id) if user_id else None)
+    print(f"✅ Rollups reconstruidos ({user_id or 'todos los usuarios'})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruye la colección expense_rollups")
+    parser.add_argument("--user-id", default=None, help="Reconstruir solo este usuario")
+    args = parser.parse_args()
+    asyncio.run(_main(args.user_id))
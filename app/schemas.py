@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 from .models import Category
 
@@ -34,4 +34,87 @@ class ExpenseOut(ExpenseBase):
     id: str
     user_id: str
 
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+class ExpensePage(BaseModel):
+    items: List[ExpenseOut]
+    next_cursor: Optional[str] = None
+
+class ExpenseFields(BaseModel):
+    # Respuesta con fields=: solo aparecen los campos pedidos
+    model_config = ConfigDict(json_schema_extra={"description": "Gasto con solo los campos indicados en fields"})
+
+    id: Optional[str] = None
+    user_id: Optional[str] = None
+    amount: Optional[float] = None
+    category: Optional[Category] = None
+    description: Optional[str] = None
+    date: Optional[datetime] = None
+
+class ExpenseFieldsPage(BaseModel):
+    items: List[ExpenseFields]
+    next_cursor: Optional[str] = None
+
+
+class CategoryTotal(BaseModel):
+    category: Category
+    total: float
+    count: int
+
+class PeriodTotal(BaseModel):
+    period: str
+    total: float
+    count: int
+
+class ExpenseStats(BaseModel):
+    total: float
+    count: int
+    by_category: List[CategoryTotal]
+    by_period: Optional[List[PeriodTotal]] = None
+
+
+class BulkRowError(BaseModel):
+    row: int
+    detail: str
+
+class BulkResult(BaseModel):
+    inserted: int
+    errors: List[BulkRowError]
+
+
+class ExpenseFilter(BaseModel):
+    category: Optional[Category] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+
+class BulkUpdateItem(BaseModel):
+    id: str
+    changes: ExpenseUpdate
+
+class BulkUpdate(BaseModel):
+    items: Optional[List[BulkUpdateItem]] = None
+    filter: Optional[ExpenseFilter] = None
+    changes: Optional[ExpenseUpdate] = None
+
+class BulkDelete(BaseModel):
+    ids: Optional[List[str]] = None
+    filter: Optional[ExpenseFilter] = None
+
+class BulkUpdateResult(BaseModel):
+    matched: int
+    modified: int
+
+class BulkDeleteResult(BaseModel):
+    deleted: int
+
+
+class ExportJob(BaseModel):
+    id: str
+    status: str
+    format: str
+    rows: int
+    size: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    download_url: Optional[str] = None
@@ -0,0 +1,115 @@
+import argparse
+import logging
+import os
+import tempfile
+from pathlib import Path
+import uvicorn
+from .config import settings
+
+try:
+    from gunicorn.app.base import BaseApplication
+    from uvicorn_worker import UvicornWorker
+except ImportError:
+    # gunicorn no funciona en Windows: se usa el supervisor de uvicorn
+    BaseApplication = None
+    UvicornWorker = None
+
+logger = logging.getLogger(__name__)
+
+APP = "app.main:app"
+
+def worker_count() -> int:
+    if settings.WEB_CONCURRENCY > 0:
+        return settings.WEB_CONCURRENCY
+    # sched_getaffinity respeta los CPUs asignados al proceso (taskset, cpuset)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+if UvicornWorker is not None:
+    class Worker(UvicornWorker):
+        CONFIG_KWARGS = {"loop": settings.SERVER_LOOP, "http": settings.SERVER_HTTP}
+
+    class GunicornApp(BaseApplication):
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Se importa en cada worker tras el fork: el cliente de Mongo, la caché
+            # y el pool de bcrypt se crean en el proceso que los usa
+            from .main import app
+            return app
+
+def gunicorn_options(workers: int) -> dict:
+    return {
+        "bind": f"{settings.HOST}:{settings.PORT}",
+        "workers": workers,
+        "worker_class": "app.server.Worker",
+        "timeout": settings.SERVER_TIMEOUT,
+        "graceful_timeout": settings.SERVER_GRACEFUL_TIMEOUT,
+        "keepalive": settings.SERVER_KEEPALIVE,
+        "max_requests": settings.SERVER_MAX_REQUESTS,
+        "max_requests_jitter": settings.SERVER_MAX_REQUESTS_JITTER,
+        "loglevel": settings.LOG_LEVEL.lower(),
+        "accesslog": "-" if settings.SERVER_ACCESS_LOG else None,
+        "errorlog": "-",
+    }
+
+def set_worker_env(name: str, value: str):
+    # Los workers heredan el entorno (spawn en Windows) o los settings ya cargados (fork)
+    os.environ[name] = value
+    setattr(settings, name, value)
+
+def prepare_workers(workers: int):
+    if settings.CACHE_BACKEND == "memory":
+        # Sigue siendo correcta (la clave lleva users.expenses_version), pero cada
+        # worker solo acierta con lo que él mismo ha cacheado
+        logger.info("CACHE_BACKEND=memory con %d workers: una caché por proceso; redis la compartiría", workers)
+    if settings.METRICS_ENABLED:
+        if not settings.METRICS_DIR:
+            set_worker_env("METRICS_DIR", tempfile.mkdtemp(prefix="expenses-metrics-"))
+        # Instantáneas de una ejecución anterior con los mismos PIDs
+        Path(settings.METRICS_DIR).mkdir(parents=True, exist_ok=True)
+        for path in Path(settings.METRICS_DIR).glob("*.json"):
+            path.unlink(missing_ok=True)
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Servidor de la API de Seguimiento de Gastos")
+    parser.add_argument("--reload", action="store_true", help="Desarrollo: un proceso con recarga automática")
+    args = parser.parse_args(argv)
+
+    print("🚀 Iniciando API de Seguimiento de Gastos...")
+    print(f"📡 Servidor: http://{settings.HOST}:{settings.PORT}")
+    print(f"📚 Documentación: http://{settings.HOST}:{settings.PORT}/docs")
+
+    if args.reload:
+        uvicorn.run(APP, host=settings.HOST, port=settings.PORT, reload=True, log_level=settings.LOG_LEVEL.lower())
+        return
+
+    workers = worker_count()
+    print(f"⚙️  Workers: {workers}")
+    if workers > 1:
+        prepare_workers(workers)
+
+    if BaseApplication is None:
+        # Sin gunicorn no hay reinicio elegante con SIGHUP ni max_requests
+        uvicorn.run(
+            APP,
+            host=settings.HOST,
+            port=settings.PORT,
+            workers=workers,
+            loop=settings.SERVER_LOOP,
+            http=settings.SERVER_HTTP,
+            timeout_keep_alive=settings.SERVER_KEEPALIVE,
+            timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT,
+            access_log=settings.SERVER_ACCESS_LOG,
+            log_level=settings.LOG_LEVEL.lower(),
+        )
+        return
+    GunicornApp(gunicorn_options(workers)).run()
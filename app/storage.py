@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import logging
+import re
+from pymongo import DeleteMany, ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Formato de almacenamiento de la colección expenses (EXPENSES_STORAGE):
+# - documents: un documento por gasto.
+# - timeseries: colección time-series de MongoDB con user_id como metaField. El
+#   servidor agrupa los gastos de cada usuario en buckets comprimidos de hasta un
+#   mes, con lo que índices y lecturas por rango tocan un documento por bucket.
+#   Las consultas no cambian, pero no hay findAndModify ni se puede modificar el
+#   campo de tiempo con un update: las modificaciones insertan la versión nueva
+#   (con "rev" incrementado) y borran las anteriores. Requiere MongoDB 7.0+.
+#   Tampoco admite índices de texto: la búsqueda usa una expresión regular.
+#   Si el proceso cae entre la inserción y el borrado, o dos modificaciones del
+#   mismo gasto se cruzan, quedan varias versiones: las lecturas (find_expenses,
+#   match_stages) devuelven solo la de mayor rev de cada gasto. Antes de descartar
+#   versiones solo se filtra por user_id y _id, que no cambian entre versiones:
+#   categoría, fecha o importe de una versión antigua no deben decidir si el
+#   gasto aparece. A cambio, cada lectura agrupa todos los gastos del usuario.
+
+EXPENSES = "expenses"
+TIMESERIES_OPTIONS = {"timeField": "date", "metaField": "user_id", "granularity": "hours"}
+ROLLUP_PROJECTION = {"user_id": 1, "amount": 1, "category": 1, "date": 1}
+
+def timeseries() -> bool:
+    return settings.EXPENSES_STORAGE == "timeseries"
+
+def latest_versions() -> list[dict]:
+    # Etapas de agregación que dejan una fila por gasto: la de mayor rev
+    return [
+        {"$sort": {"_id": 1, "rev": -1}},
+        {"$group": {"_id": "$_id", "doc": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$doc"}},
+    ]
+
+# Campos iguales en todas las versiones de un gasto
+STABLE_FIELDS = ("user_id", "_id")
+
+def split_filter(q: dict) -> tuple[dict, dict]:
+    """Separa `q` en lo que se puede aplicar antes de descartar versiones y el resto."""
+    before = {key: value for key, value in q.items() if key in STABLE_FIELDS}
+    after = {key: value for key, value in q.items() if key not in STABLE_FIELDS}
+    return before, after
+
+def match_stages(q: dict) -> list[dict]:
+    """Primeras etapas de una agregación sobre los gastos de `q`."""
+    if not timeseries():
+        return [{"$match": q}]
+    before, after = split_filter(q)
+    stages = [{"$match": before}, *latest_versions()]
+    if after:
+        stages.append({"$match": after})
+    return stages
+
+def find_expenses(db, q: dict, projection: dict | None = None, sort: list | None = None, limit: int = 0, batch_size: int = 0):
+    """
+    Cursor sobre los gastos de `q`. Con documentos es un find normal; con
+    time-series una agregación que descarta las versiones antiguas de cada
+    gasto antes de ordenar y limitar.
+    """
+    if not timeseries():
+        cursor = db[EXPENSES].find(q, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+    pipeline = match_stages(q)
+    if sort:
+        pipeline.append({"$sort": dict(sort)})
+    if limit:
+        pipeline.append({"$limit": limit})
+    if projection:
+        pipeline.append({"$project": projection})
+    options = {"batchSize": batch_size} if batch_size else {}
+    return db[EXPENSES].aggregate(pipeline, allowDiskUse=True, **options)
+
+def text_filter(search: str) -> dict:
+    # Con documentos: índice de texto {user_id, description} (palabras con
+    # raíz en español, sin mayúsculas ni tildes). Cualquiera de las palabras basta.
+    if not timeseries():
+        return {"$text": {"$search": search}}
+    words = re.findall(r"\w+", search)
+    return {"description": {"$regex": "|".join(re.escape(word) for word in words), "$options": "i"}}
+
+async def collection_type(db, name: str = EXPENSES) -> str | None:
+    cursor = await db.list_collections(filter={"name": name})
+    infos = await cursor.to_list(length=1)
+    return infos[0].get("type", "collection") if infos else None
+
+async def ensure_collection(db):
+    # Debe ejecutarse antes que cualquier escritura o create_index: ambos crean
+    # la colección como normal si no existe
+    if not timeseries():
+        return
+    kind = await collection_type(db)
+    if kind is None:
+        await db.create_collection(EXPENSES, timeseries=TIMESERIES_OPTIONS)
+        logger.info("Creada la colección time-series %s", EXPENSES)
+    elif kind != "timeseries":
+        logger.error("EXPENSES_STORAGE=timeseries pero %s es una colección normal: ejecute python -m app.storage --to timeseries", EXPENSES)
+
+async def ensure_collection_safely(db):
+    try:
+        await ensure_collection(db)
+    except PyMongoError:
+        logger.exception("No se pudo verificar la colección %s", EXPENSES)
+
+def newest(versions: list[dict]) -> dict:
+    return max(versions, key=lambda doc: doc.get("rev") or 0)
+
+def group_versions(docs: list[dict]) -> dict:
+    grouped: dict = {}
+    for doc in docs:
+        grouped.setdefault(doc["_id"], []).append(doc)
+    return grouped
+
+async def replace_expenses(db, replacements: list[tuple[list[dict], dict]]):
+    """
+    Sustituye las versiones guardadas de cada gasto por su documento nuevo. Primero
+    se inserta la versión nueva y después se borran las leídas: un fallo entre ambos
+    pasos (o dos modificaciones simultáneas) deja un duplicado, nunca un gasto
+    perdido, y la siguiente modificación de ese gasto lo elimina.
+    """
+    if not replacements:
+        return
+    expenses = db[EXPENSES]
+    await expenses.insert_many(
+        [{**new, "rev": max(doc.get("rev") or 0 for doc in versions) + 1} for versions, new in replacements],
+        ordered=False,
+    )
+    await expenses.bulk_write(
+        [
+            DeleteMany({"_id": new["_id"], "user_id": new["user_id"], "rev": {"$in": list({doc.get("rev") for doc in versions})}})
+            for versions, new in replacements
+        ],
+        ordered=False,
+    )
+
+async def update_expense(db, user_id, oid, updates: dict) -> dict | None:
+    """Aplica `updates` al gasto y devuelve su estado previo, o None si no existe."""
+    expenses = db[EXPENSES]
+    if not timeseries():
+        return await expenses.find_one_and_update(
+            {"_id": oid, "user_id": user_id},
+            {"$set": updates},
+            return_document=ReturnDocument.BEFORE,
+        )
+    versions = await expenses.find({"_id": oid, "user_id": user_id}).to_list(length=None)
+    if not versions:
+        return None
+    old = newest(versions)
+    new = {**old, **updates}
+    if new != old or len(versions) > 1:
+        await replace_expenses(db, [(versions, new)])
+    return old
+
+async def update_expenses(db, q: dict, changes: dict, load_old: bool) -> tuple[int, int, list, list]:
+    """
+    Actualiza los gastos de `q`. `changes` es un dict {_id: updates} por gasto o,
+    con la clave None, los mismos updates para todos. Devuelve (coincidentes,
+    modificados, previos, nuevos); previos/nuevos solo si `load_old` o time-series.
+    """
+    expenses = db[EXPENSES]
+    changes_for = (lambda doc: changes[None]) if None in changes else (lambda doc: changes[doc["_id"]])
+    if timeseries():
+        # Los gastos cuya versión actual cumple q, y después todas sus versiones:
+        # una versión antigua no debe decidir ni la selección ni el rev siguiente
+        ids = [doc["_id"] for doc in await find_expenses(db, q, {"_id": 1}).to_list(length=None)]
+        if not ids:
+            return 0, 0, [], []
+        grouped = group_versions(await expenses.find({"_id": {"$in": ids}, "user_id": q["user_id"]}).to_list(length=None))
+        replacements, old, new = [], [], []
+        for versions in grouped.values():
+            doc = newest(versions)
+            updated = {**doc, **changes_for(doc)}
+            if updated != doc or len(versions) > 1:
+                replacements.append((versions, updated))
+            if updated != doc:
+                old.append(doc)
+                new.append(updated)
+        await replace_expenses(db, replacements)
+        return len(grouped), len(old), old, new
+
+    old = await expenses.find(q, ROLLUP_PROJECTION).to_list(length=None) if load_old else []
+    if None in changes:
+        res = await expenses.update_many(q, {"$set": changes[None]})
+    else:
+        res = await expenses.bulk_write(
+            [UpdateOne({"_id": oid, "user_id": q["user_id"]}, {"$set": updates}) for oid, updates in changes.items()],
+            ordered=False,
+        )
+    return res.matched_count, res.modified_count, old, [{**doc, **changes_for(doc)} for doc in old]
+
+async def delete_expense(db, user_id, oid) -> dict | None:
+    expenses = db[EXPENSES]
+    if not timeseries():
+        return await expenses.find_one_and_delete({"_id": oid, "user_id": user_id})
+    versions = await expenses.find({"_id": oid, "user_id": user_id}).to_list(length=None)
+    if not versions:
+        return None
+    await expenses.delete_many({"_id": oid, "user_id": user_id})
+    return newest(versions)
+
+async def migrate(db, target: str) -> int | None:
+    """
+    Reescribe expenses en el formato `target` con $out en el servidor. La
+    colección original queda como expenses_<formato anterior>_backup. Las
+    escrituras durante la migración se pierden: detener la API antes.
+    """
+    current = await collection_type(db)
+    if current is None:
+        raise RuntimeError(f"No existe la colección {EXPENSES}")
+    if (current == "timeseries") == (target == "timeseries"):
+        return None
+
+    # Gastos distintos: en time-series puede haber varias versiones del mismo
+    if current == "timeseries":
+        counted = await db[EXPENSES].aggregate([{"$group": {"_id": "$_id"}}, {"$count": "n"}], allowDiskUse=True).to_list(length=1)
+        count = counted[0]["n"] if counted else 0
+    else:
+        count = await db[EXPENSES].count_documents({})
+    source = f"{EXPENSES}_{'timeseries' if current == 'timeseries' else 'documents'}_backup"
+    if await collection_type(db, source) is not None:
+        raise RuntimeError(f"Ya existe {source}: bórrela o renómbrela antes de migrar")
+
+    if target == "timeseries":
+        # Una colección time-series no se puede renombrar: se renombra la original
+        # y $out crea expenses directamente con el nuevo formato
+        await db[EXPENSES].rename(source)
+        await db[source].aggregate([
+            {"$out": {"db": db.name, "coll": EXPENSES, "timeseries": TIMESERIES_OPTIONS}},
+        ]).to_list(length=None)
+    else:
+        # Las versiones duplicadas chocarían en el _id de la colección normal
+        await db[EXPENSES].aggregate([
+            *latest_versions(),
+            {"$unset": "rev"},
+            {"$out": f"{EXPENSES}_migrating"},
+        ], allowDiskUse=True).to_list(length=None)
+        await db[EXPENSES].aggregate([{"$out": source}]).to_list(length=None)
+        await db[EXPENSES].drop()
+        await db[f"{EXPENSES}_migrating"].rename(EXPENSES)
+
+    migrated = await db[EXPENSES].count_documents({})
+    if migrated != count:
+        raise RuntimeError(f"Se esperaban {count} gastos y hay {migrated}; el original sigue en {source}")
+    return migrated
+
+async def _main(target: str):
+    from .db import get_client
+    from . import indexes
+
+    db = get_client()[settings.MONGO_DB]
+    migrated = await migrate(db, target)
+    if migrated is None:
+        print(f"ℹ️  {EXPENSES} ya está en formato {target}")
+        return
+    await db[EXPENSES].create_indexes(indexes.required_indexes(EXPENSES, timeseries=target == "timeseries"))
+    print(f"✅ {migrated} gastos migrados a {target}; ponga EXPENSES_STORAGE={target} y reinicie la API")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migra la colección expenses entre formatos de almacenamiento")
+    parser.add_argument("--to", choices=["documents", "timeseries"], required=True)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args.to))
@@ -1,7 +1,12 @@
+import asyncio
+import threading
+import time
 import jwt
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from passlib.context import CryptContext
 from .config import settings
+from .metrics import BCRYPT_DURATION, add_timing
 
 pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -13,6 +18,72 @@ def hash_password(password: str) -> str:
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_ctx.verify(plain, hashed)
 
+# bcrypt fuera del event loop: pool de hilos acotado (bcrypt libera el GIL)
+# con límite de cola; si está lleno se rechaza en vez de acumular latencia
+
+class HashPoolBusy(Exception):
+    pass
+
+_hash_pool: ThreadPoolExecutor | None = None
+# La cuenta la cierra el callback del trabajo, que puede ejecutarse en un hilo del pool
+_hash_lock = threading.Lock()
+_hash_stats = {"in_flight": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+def get_hash_pool() -> ThreadPoolExecutor:
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(max_workers=settings.HASH_POOL_WORKERS, thread_name_prefix="bcrypt")
+    return _hash_pool
+
+def _hash_done(future: Future, name: str, start: float):
+    with _hash_lock:
+        _hash_stats["in_flight"] -= 1
+        if future.cancelled() or future.exception() is not None:
+            _hash_stats["failed"] += 1
+        else:
+            _hash_stats["completed"] += 1
+    BCRYPT_DURATION.observe(time.perf_counter() - start, name)
+
+async def run_in_hash_pool(fn, *args):
+    with _hash_lock:
+        if _hash_stats["in_flight"] >= settings.HASH_POOL_WORKERS + settings.HASH_POOL_QUEUE:
+            _hash_stats["rejected"] += 1
+            raise HashPoolBusy()
+        _hash_stats["in_flight"] += 1
+    start = time.perf_counter()
+    try:
+        future = get_hash_pool().submit(fn, *args)
+    except BaseException:
+        with _hash_lock:
+            _hash_stats["in_flight"] -= 1
+        raise
+    # Si el cliente se desconecta, el trabajo ya en ejecución sigue ocupando su hilo:
+    # solo deja de contar cuando termina (o si se cancela antes de empezar)
+    future.add_done_callback(lambda done: _hash_done(done, fn.__name__, start))
+    try:
+        return await asyncio.wrap_future(future)
+    finally:
+        add_timing("bcrypt", time.perf_counter() - start)
+
+async def hash_password_async(password: str) -> str:
+    return await run_in_hash_pool(hash_password, password)
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    return await run_in_hash_pool(verify_password, plain, hashed)
+
+def hash_pool_stats() -> dict:
+    workers = settings.HASH_POOL_WORKERS
+    in_flight = _hash_stats["in_flight"]
+    return {
+        "workers": workers,
+        "active": min(in_flight, workers),
+        "queued": max(in_flight - workers, 0),
+        "queue_limit": settings.HASH_POOL_QUEUE,
+        "completed": _hash_stats["completed"],
+        "failed": _hash_stats["failed"],
+        "rejected": _hash_stats["rejected"],
+    }
+
 # JWT helpers
 
 def create_access_token(subject: str) -> str:
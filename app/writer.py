@@ -0,0 +1,106 @@
+import asyncio
+import contextvars
+import logging
+from bson import ObjectId
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError
+from .config import settings
+from .metrics import INSERT_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Agrupa las inserciones de muchas peticiones en un solo insert_many: cada
+# petición espera un future que se resuelve con su _id al escribirse el lote.
+# El _id se asigna en el cliente para que cada fila sepa el suyo aunque falle otra.
+
+def write_concern() -> WriteConcern | None:
+    if not settings.INSERT_WRITE_CONCERN and settings.INSERT_JOURNAL is None:
+        return None
+    w = settings.INSERT_WRITE_CONCERN or None
+    if w is not None and w.isdigit():
+        w = int(w)
+    return WriteConcern(w=w, j=settings.INSERT_JOURNAL)
+
+class InsertBatcher:
+    def __init__(self, collection: str, on_flush, max_batch: int, window_ms: float):
+        # on_flush(db, docs) se llama con las filas escritas, antes de responder
+        self.collection = collection
+        self.on_flush = on_flush
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self.pending: list[tuple[dict, asyncio.Future]] = []
+        self.db = None
+        self.timer: asyncio.TimerHandle | None = None
+        self.flushing: set[asyncio.Task] = set()
+
+    async def insert(self, db, doc: dict) -> ObjectId:
+        loop = asyncio.get_running_loop()
+        doc.setdefault("_id", ObjectId())
+        future = loop.create_future()
+        self.db = db
+        self.pending.append((doc, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            # Contexto vacío: los tiempos de Mongo del lote no se atribuyen a una petición
+            self.timer = loop.call_later(self.window, self.flush, context=contextvars.Context())
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        task = asyncio.create_task(self.write(self.db, batch), context=contextvars.Context())
+        self.flushing.add(task)
+        task.add_done_callback(self.flushing.discard)
+
+    async def write(self, db, batch: list[tuple[dict, asyncio.Future]]):
+        INSERT_BATCH_SIZE.observe(len(batch))
+        docs = [doc for doc, _ in batch]
+        collection = db[self.collection]
+        concern = write_concern()
+        if concern is not None:
+            collection = collection.with_options(write_concern=concern)
+
+        failed: dict[int, Exception] = {}
+        inserted = False
+        try:
+            try:
+                await collection.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    failed[error["index"]] = BulkWriteError({"writeErrors": [error]})
+            except Exception as e:
+                # Red, InvalidDocument...: no se sabe qué filas se guardaron
+                failed = {i: e for i in range(len(batch))}
+            inserted = True
+
+            written = [doc for i, doc in enumerate(docs) if i not in failed]
+            if written:
+                # Las filas ya están guardadas: un fallo aquí no llega a las peticiones,
+                # que al reintentar crearían el gasto dos veces
+                try:
+                    await self.on_flush(db, written)
+                except Exception:
+                    logger.exception("Falló el post-proceso de %d inserciones agrupadas ya guardadas", len(written))
+        finally:
+            # Ninguna petición se queda esperando, ni siquiera si se cancela el lote
+            interrupted = RuntimeError("Inserción agrupada interrumpida")
+            for i, (doc, future) in enumerate(batch):
+                # La petición pudo cancelarse (cliente desconectado) mientras esperaba
+                if future.done():
+                    continue
+                if not inserted:
+                    future.set_exception(interrupted)
+                elif i in failed:
+                    future.set_exception(failed[i])
+                else:
+                    future.set_result(doc["_id"])
+
+    async def close(self):
+        self.flush()
+        if self.flushing:
+            await asyncio.gather(*self.flushing, return_exceptions=True)
@@ -0,0 +1,45 @@
+"""
+Fixtures de los benchmarks: un único event loop para toda la sesión (el cliente
+de Motor queda ligado a él), base de datos sembrada y cliente ASGI en proceso.
+"""
+
+import asyncio
+import os
+
+# La caché de respuestas convertiría los listados en aciertos de memoria
+os.environ.setdefault("CACHE_BACKEND", "none")
+os.environ.setdefault("SLOW_QUERY_MS", "0")
+
+import httpx
+import pytest
+
+from app import indexes
+from app.main import app
+
+from .fakedb import bench_database, seed, use_database
+from .scenarios import Context
+
+BENCH_USERS = int(os.getenv("BENCH_USERS", "5"))
+BENCH_EXPENSES = int(os.getenv("BENCH_EXPENSES", "2000"))
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture(scope="session")
+def bench_context(loop):
+    db = bench_database()
+    use_database(app, db)
+    if os.getenv("BENCH_MONGO_URI"):
+        loop.run_until_complete(indexes.ensure_indexes(db))
+    users = loop.run_until_complete(seed(db, BENCH_USERS, BENCH_EXPENSES))
+    yield Context(users=users)
+    app.dependency_overrides.clear()
+
+@pytest.fixture(scope="session")
+def http(loop):
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+    yield client
+    loop.run_until_complete(client.aclose())
@@ -0,0 +1,61 @@
+"""
+Base de datos para los benchmarks: un mongod real si BENCH_MONGO_URI está
+definido, o mongomock-motor en memoria en caso contrario.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app.db import get_db
+from app.models import Category
+from app.utils import create_access_token, hash_password
+
+BENCH_DB = os.getenv("BENCH_MONGO_DB", "expenses_bench")
+PASSWORD = "benchpassword"
+
+def bench_database():
+    uri = os.getenv("BENCH_MONGO_URI")
+    if uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        return AsyncIOMotorClient(uri)[BENCH_DB]
+    from mongomock_motor import AsyncMongoMockClient
+
+    return AsyncMongoMockClient()[BENCH_DB]
+
+def use_database(app, db):
+    async def override():
+        return db
+
+    app.dependency_overrides[get_db] = override
+
+def make_expenses(n: int) -> list[dict]:
+    """`n` gastos repartidos en los últimos 120 días, del más reciente al más antiguo."""
+    categories = [c.value for c in Category]
+    now = datetime.utcnow()
+    return [
+        {
+            "amount": round(5 + (i * 7919) % 500 * 0.75, 2),
+            "category": categories[i % len(categories)],
+            "description": f"Gasto de prueba {i}",
+            "date": now - timedelta(minutes=i * 120 * 24 * 60 // max(n, 1)),
+        }
+        for i in range(n)
+    ]
+
+async def seed(db, users: int, expenses: int) -> list[dict]:
+    """Crea `users` usuarios con `expenses` gastos cada uno, directamente en la base."""
+    await db["users"].delete_many({"email": {"$regex": "^bench-"}})
+    hashed = hash_password(PASSWORD)
+    seeded = []
+    for u in range(users):
+        email = f"bench-{u}@example.com"
+        user_id = (await db["users"].insert_one({"email": email, "password": hashed})).inserted_id
+        await db["expenses"].delete_many({"user_id": user_id})
+        docs = [{"_id": ObjectId(), "user_id": user_id, **row} for row in make_expenses(expenses)]
+        for start in range(0, len(docs), 5000):
+            await db["expenses"].insert_many(docs[start:start + 5000])
+        seeded.append({"email": email, "user_id": user_id, "token": create_access_token(str(user_id))})
+    return seeded
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de la API: latencias p50/p99 y throughput por operación.
+
+Sin --base-url la app se ejecuta en el mismo proceso sobre BENCH_MONGO_URI o,
+si no está definido, sobre mongomock-motor en memoria. Con --base-url se ataca
+un servidor ya arrancado (uvicorn, docker-compose...).
+
+Uso:
+    python -m benchmarks.load --output benchmarks/baseline.json
+    python -m benchmarks.load --base-url http://localhost:8000 --compare benchmarks/baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+from .scenarios import OPERATIONS, Context, percentile
+
+async def seed_through_api(client, run_id: str, users: int, expenses: int) -> list[dict]:
+    from .fakedb import PASSWORD, make_expenses
+
+    seeded = []
+    for u in range(users):
+        email = f"bench-{run_id}-{u}@example.com"
+        credentials = {"email": email, "password": PASSWORD}
+        (await client.post("/auth/register", json=credentials)).raise_for_status()
+        response = await client.post("/auth/login", json=credentials)
+        response.raise_for_status()
+        user = {"email": email, "token": response.json()["access_token"]}
+        rows = [{**row, "date": row["date"].isoformat()} for row in make_expenses(expenses)]
+        for start in range(0, len(rows), 5000):
+            response = await client.post(
+                "/expenses/bulk",
+                json=rows[start:start + 5000],
+                headers={"Authorization": f"Bearer {user['token']}"},
+            )
+            response.raise_for_status()
+        seeded.append(user)
+    return seeded
+
+async def measure(client, ctx: Context, operation, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            t0 = time.perf_counter()
+            try:
+                response = await operation(client, ctx)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - t0)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+    }
+
+def in_process_client() -> httpx.AsyncClient:
+    os.environ.setdefault("CACHE_BACKEND", "none")
+    os.environ.setdefault("SLOW_QUERY_MS", "0")
+    from app.main import app
+
+    from .fakedb import bench_database, use_database
+
+    use_database(app, bench_database())
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+async def run(args) -> dict:
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+    else:
+        client = in_process_client()
+    names = args.operations.split(",") if args.operations else list(OPERATIONS)
+    unknown = [name for name in names if name not in OPERATIONS]
+    if unknown:
+        raise SystemExit(f"Operaciones desconocidas: {', '.join(unknown)}")
+
+    async with client:
+        ctx = Context(users=[])
+        print(f"Sembrando {args.users} usuarios x {args.expenses} gastos...", file=sys.stderr)
+        ctx.users = await seed_through_api(client, ctx.run_id, args.users, args.expenses)
+        results = {}
+        for name in names:
+            requests = args.auth_requests if name in ("register", "login") else args.requests
+            results[name] = await measure(client, ctx, OPERATIONS[name], requests, args.concurrency)
+            print(f"{name:>20} {results[name]['p50_ms']:>9.1f} ms p50 {results[name]['p99_ms']:>9.1f} ms p99 "
+                  f"{results[name]['throughput_rps']:>9.1f} req/s {results[name]['errors']:>5} errores", file=sys.stderr)
+
+    return {
+        "meta": {
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+            "target": args.base_url or ("in-process mongod" if os.getenv("BENCH_MONGO_URI") else "in-process mongomock"),
+            "python": platform.python_version(),
+            "users": args.users,
+            "expenses_per_user": args.expenses,
+            "concurrency": args.concurrency,
+        },
+        "operations": results,
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Operaciones cuya p99 o throughput empeora más que `tolerance` respecto a la línea base."""
+    regressions = []
+    print(f"{'operación':>20} {'p99 base':>10} {'p99 ahora':>10} {'req/s base':>11} {'req/s ahora':>11}")
+    for name, now in current["operations"].items():
+        base = baseline["operations"].get(name)
+        if base is None:
+            continue
+        print(f"{name:>20} {base['p99_ms']:>10.1f} {now['p99_ms']:>10.1f} {base['throughput_rps']:>11.1f} {now['throughput_rps']:>11.1f}")
+        if now["p99_ms"] > base["p99_ms"] * (1 + tolerance) or now["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API de gastos")
+    parser.add_argument("--base-url", help="Servidor a medir; por defecto la app en proceso")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--expenses", type=int, default=2000, help="Gastos sembrados por usuario")
+    parser.add_argument("--requests", type=int, default=500, help="Peticiones por operación")
+    parser.add_argument("--auth-requests", type=int, default=50, help="Peticiones de register/login (bcrypt)")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--operations", help=f"Lista separada por comas de: {', '.join(OPERATIONS)}")
+    parser.add_argument("--output", help="Fichero JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="Línea base JSON con la que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Empeoramiento admitido (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    if args.compare and not os.path.exists(args.compare):
+        parser.error(f"no existe la línea base {args.compare}: generarla antes con make load o --output")
+
+    result = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regresiones: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
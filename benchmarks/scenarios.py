@@ -0,0 +1,86 @@
+"""
+Operaciones medidas por los benchmarks y por el script de carga.
+
+Cada operación es una corrutina que recibe un httpx.AsyncClient y el contexto
+compartido, y devuelve la respuesta. El mismo código sirve contra la app en
+proceso (ASGITransport) o contra un servidor en marcha.
+"""
+
+import itertools
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from .fakedb import PASSWORD
+
+@dataclass
+class Context:
+    users: list[dict]
+    # Gastos creados durante la medición: patch y delete trabajan sobre ellos
+    created: list[tuple[dict, str]] = field(default_factory=list)
+    counter: itertools.count = field(default_factory=itertools.count)
+    run_id: str = field(default_factory=lambda: datetime.utcnow().strftime("%Y%m%d%H%M%S%f"))
+
+    def user(self) -> dict:
+        return random.choice(self.users)
+
+def percentile(data: list[float], p: float) -> float:
+    # Sin interpolar: el valor medido en esa posición, igual en benchmarks y carga
+    ordered = sorted(data)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def auth(user: dict) -> dict:
+    return {"Authorization": f"Bearer {user['token']}"}
+
+async def register(client, ctx: Context):
+    email = f"bench-new-{ctx.run_id}-{next(ctx.counter)}@example.com"
+    return await client.post("/auth/register", json={"email": email, "password": PASSWORD})
+
+async def login(client, ctx: Context):
+    return await client.post("/auth/login", json={"email": ctx.user()["email"], "password": PASSWORD})
+
+async def create(client, ctx: Context):
+    user = ctx.user()
+    response = await client.post(
+        "/expenses",
+        json={"amount": 12.5, "category": "ocio", "description": "Benchmark", "date": datetime.utcnow().isoformat()},
+        headers=auth(user),
+    )
+    if response.status_code == 201:
+        ctx.created.append((user, response.json()["id"]))
+    return response
+
+async def patch(client, ctx: Context):
+    if not ctx.created:
+        await create(client, ctx)
+    user, expense_id = random.choice(ctx.created)
+    return await client.patch(f"/expenses/{expense_id}", json={"amount": 20.0}, headers=auth(user))
+
+async def delete(client, ctx: Context):
+    if not ctx.created:
+        await create(client, ctx)
+    user, expense_id = ctx.created.pop()
+    return await client.delete(f"/expenses/{expense_id}", headers=auth(user))
+
+def list_expenses(rango: str | None):
+    async def run(client, ctx: Context):
+        params = {}
+        if rango == "custom":
+            end = datetime.utcnow()
+            params = {"rango": "custom", "start_date": (end - timedelta(days=45)).isoformat(), "end_date": end.isoformat()}
+        elif rango:
+            params = {"rango": rango}
+        return await client.get("/expenses", params=params, headers=auth(ctx.user()))
+    return run
+
+LIST_RANGES = [None, "past_week", "past_month", "last_3_months", "custom"]
+
+# Orden de ejecución: create antes que patch/delete para que haya gastos propios
+OPERATIONS = {
+    "register": register,
+    "login": login,
+    "create": create,
+    **{f"list_{rango or 'all'}": list_expenses(rango) for rango in LIST_RANGES},
+    "patch": patch,
+    "delete": delete,
+}
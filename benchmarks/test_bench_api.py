@@ -0,0 +1,56 @@
+"""
+Benchmarks de la API con pytest-benchmark.
+
+Uso: pytest benchmarks --benchmark-autosave
+     pytest benchmarks --benchmark-compare   (contra la última ejecución guardada)
+"""
+
+import pytest
+
+from .scenarios import LIST_RANGES, OPERATIONS, percentile
+
+def record_percentiles(benchmark):
+    # pytest-benchmark da mediana pero no p99: se guarda junto al resultado
+    if benchmark.stats is None:
+        # --benchmark-disable: la operación se ejecuta una vez sin medir
+        return
+    data = benchmark.stats.stats.data
+    benchmark.extra_info["p50_ms"] = round(percentile(data, 0.50) * 1000, 3)
+    benchmark.extra_info["p99_ms"] = round(percentile(data, 0.99) * 1000, 3)
+
+def run(benchmark, loop, http, ctx, name: str, expected: int):
+    operation = OPERATIONS[name]
+    response = benchmark(lambda: loop.run_until_complete(operation(http, ctx)))
+    assert response.status_code == expected, response.text
+    record_percentiles(benchmark)
+
+class TestAuthBench:
+    def test_register(self, benchmark, loop, http, bench_context):
+        run(benchmark, loop, http, bench_context, "register", 201)
+
+    def test_login(self, benchmark, loop, http, bench_context):
+        run(benchmark, loop, http, bench_context, "login", 200)
+
+class TestExpensesBench:
+    def test_create(self, benchmark, loop, http, bench_context):
+        run(benchmark, loop, http, bench_context, "create", 201)
+
+    @pytest.mark.parametrize("rango", LIST_RANGES, ids=lambda rango: rango or "all")
+    def test_list(self, benchmark, loop, http, bench_context, rango):
+        run(benchmark, loop, http, bench_context, f"list_{rango or 'all'}", 200)
+
+    def test_patch(self, benchmark, loop, http, bench_context):
+        run(benchmark, loop, http, bench_context, "patch", 200)
+
+    def test_delete(self, benchmark, loop, http, bench_context):
+        # Cada ronda borra un gasto: se crea uno antes, fuera de la medición
+        def setup():
+            loop.run_until_complete(OPERATIONS["create"](http, bench_context))
+
+        response = benchmark.pedantic(
+            lambda: loop.run_until_complete(OPERATIONS["delete"](http, bench_context)),
+            setup=setup,
+            rounds=50,
+        )
+        assert response.status_code == 204
+        record_percentiles(benchmark)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark de serialización del listado de gastos (sin MongoDB).
+
+Compara el camino anterior (coroutine + ExpenseOut validado + revalidación
+contra response_model + JSON estándar) con el actual (dict directo + orjson).
+
+Uso: python scripts/bench_serialization.py [filas ...]
+"""
+
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.main import expense_row  # noqa: E402
+from app.models import Category  # noqa: E402
+from app.schemas import ExpenseOut  # noqa: E402
+
+def make_docs(n):
+    user_id = ObjectId()
+    categories = [c.value for c in Category]
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "amount": round(10 + i % 500 * 1.5, 2),
+            "category": categories[i % len(categories)],
+            "description": f"Gasto {i}",
+            "date": start + timedelta(minutes=i),
+        }
+        for i in range(n)
+    ]
+
+# Camino anterior, tal como estaba en app/main.py
+async def serialize_expense_before(doc) -> ExpenseOut:
+    return ExpenseOut(
+        id=str(doc["_id"]),
+        user_id=str(doc["user_id"]),
+        amount=doc["amount"],
+        category=doc["category"],
+        description=doc.get("description"),
+        date=doc["date"],
+    )
+
+response_field = create_model_field(name="Response", type_=List[ExpenseOut], mode="serialization")
+
+async def before(docs) -> bytes:
+    results = [await serialize_expense_before(doc) for doc in docs]
+    content = await serialize_response(field=response_field, response_content=results)
+    return JSONResponse(content).body
+
+async def after(docs) -> bytes:
+    return ORJSONResponse([expense_row(doc) for doc in docs]).body
+
+def bench(fn, docs, repeat=3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        asyncio.run(fn(docs))
+        best = min(best, time.perf_counter() - t0)
+    return len(docs) / best
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [10_000, 100_000]
+    print(f"{'filas':>8} {'antes (filas/s)':>16} {'ahora (filas/s)':>16} {'mejora':>8}")
+    for n in sizes:
+        docs = make_docs(n)
+        rate_before = bench(before, docs)
+        rate_after = bench(after, docs)
+        print(f"{n:>8} {rate_before:>16,.0f} {rate_after:>16,.0f} {rate_after / rate_before:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
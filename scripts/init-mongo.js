@@ -7,13 +7,22 @@ db = db.getSiblingDB('expenses_db');
 // Crear colecciones
 db.createCollection('users');
 db.createCollection('expenses');
+db.createCollection('expense_rollups');
+db.createCollection('export_jobs');
 
-// Crear índices para optimizar consultas
+// Crear índices para optimizar consultas (mantener en sincronía con app/indexes.py)
 db.users.createIndex({ "email": 1 }, { unique: true });
-db.expenses.createIndex({ "user_id": 1, "date": -1 });
-db.expenses.createIndex({ "user_id": 1, "category": 1 });
+db.expenses.createIndex({ "user_id": 1, "date": -1, "_id": -1 });
+db.expenses.createIndex({ "user_id": 1, "category": 1, "date": -1, "_id": -1 });
+db.expenses.createIndex({ "user_id": 1, "amount": -1, "_id": -1 });
+db.expenses.createIndex({ "user_id": 1, "category": 1, "amount": -1, "_id": -1 });
 db.expenses.createIndex({ "date": -1 });
+db.expenses.createIndex({ "user_id": 1, "description": "text" }, { default_language: "spanish" });
+db.expense_rollups.createIndex({ "user_id": 1, "year_month": 1, "category": 1 }, { unique: true });
+db.export_jobs.createIndex({ "status": 1, "created_at": 1 });
+db.export_jobs.createIndex({ "user_id": 1, "status": 1 });
+db.export_jobs.createIndex({ "expires_at": 1 });
 
 print('✅ Base de datos inicializada correctamente');
-print('📊 Colecciones creadas: users, expenses');
+print('📊 Colecciones creadas: users, expenses, expense_rollups, export_jobs');
 print('🔍 Índices creados para optimizar consultas');
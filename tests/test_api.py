@@ -6,6 +6,7 @@ import pytest
 from fastapi.testclient import TestClient
 from datetime import datetime, timedelta
 import json
+import os
 
 from app.main import app
 
@@ -71,6 +72,124 @@ class TestAuth:
         response = client.post("/auth/login", json=login_data)
         assert response.status_code == 401
 
+    def test_cached_token_still_rejects_tampering(self):
+        """Test caché de tokens con token alterado"""
+        user_data = {
+            "email": "tokencache@example.com",
+            "password": "testpassword123"
+        }
+        client.post("/auth/register", json=user_data)
+        token = client.post("/auth/login", json=user_data).json()["access_token"]
+        
+        # Dos peticiones con el mismo token: la segunda usa la caché
+        for _ in range(2):
+            response = client.get("/expenses", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 200
+        
+        response = client.get("/expenses", headers={"Authorization": f"Bearer {token}x"})
+        assert response.status_code == 401
+    
+    def test_health_reports_hash_pool(self):
+        """Test métricas del pool de hashing"""
+        response = client.get("/health")
+        assert response.status_code == 200
+        
+        pool = response.json()["hash_pool"]
+        assert pool["active"] <= pool["workers"]
+        assert pool["queued"] <= pool["queue_limit"]
+
+    def test_hash_pool_full_returns_503(self, monkeypatch):
+        """Test con el pool de bcrypt y su cola llenos login y registro responden 503"""
+        import threading
+        import time
+        from app import utils
+
+        # Un hilo y sin cola: basta una tarea bloqueada para llenarlo
+        monkeypatch.setattr(utils.settings, "HASH_POOL_WORKERS", 1)
+        monkeypatch.setattr(utils.settings, "HASH_POOL_QUEUE", 0)
+        release = threading.Event()
+        user_data = {"email": "busy@example.com", "password": "testpassword123"}
+        # El login solo usa bcrypt si el usuario existe
+        client.post("/auth/register", json=user_data)
+
+        def blocker():
+            release.wait(10)
+
+        with TestClient(app) as app_client:
+            busy = app_client.portal.start_task_soon(utils.run_in_hash_pool, blocker)
+            try:
+                for _ in range(1000):
+                    if utils.hash_pool_stats()["active"] == 1:
+                        break
+                    time.sleep(0.01)
+                rejected = utils.hash_pool_stats()["rejected"]
+
+                requests = [
+                    ("/auth/register", {"email": "busy-new@example.com", "password": "testpassword123"}),
+                    ("/auth/login", user_data),
+                ]
+                for path, payload in requests:
+                    response = app_client.post(path, json=payload)
+                    assert response.status_code == 503
+                    assert response.headers["retry-after"] == "1"
+                assert utils.hash_pool_stats()["rejected"] == rejected + 2
+            finally:
+                release.set()
+                busy.result(timeout=10)
+
+        # Con el pool libre se vuelve a atender
+        assert client.post("/auth/login", json=user_data).status_code == 200
+
+    def test_hash_pool_counts_abandoned_jobs_until_done(self):
+        """Test un trabajo de bcrypt cuya petición se cancela sigue ocupando el pool hasta terminar"""
+        import asyncio
+        import threading
+        from app import utils
+        
+        release = threading.Event()
+        started = threading.Event()
+        
+        def blocker():
+            started.set()
+            release.wait(10)
+        
+        def broken():
+            raise ValueError("hash inválido")
+        
+        async def run():
+            before = utils.hash_pool_stats()
+            task = asyncio.create_task(utils.run_in_hash_pool(blocker))
+            await asyncio.to_thread(started.wait, 10)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            # La petición ya no espera, pero el hilo sigue ocupado
+            abandoned = utils.hash_pool_stats()["active"] + utils.hash_pool_stats()["queued"]
+            release.set()
+            for _ in range(100):
+                if utils.hash_pool_stats()["completed"] > before["completed"]:
+                    break
+                await asyncio.sleep(0.01)
+            
+            with pytest.raises(ValueError):
+                await utils.run_in_hash_pool(broken)
+            return before, abandoned, utils.hash_pool_stats()
+        
+        before, abandoned, after = asyncio.run(run())
+        assert abandoned == before["active"] + before["queued"] + 1
+        assert after["active"] + after["queued"] == before["active"] + before["queued"]
+        assert after["completed"] == before["completed"] + 1
+        assert after["failed"] == before["failed"] + 1
+    
+    def test_metrics_endpoint(self):
+        """Test métricas Prometheus y Server-Timing"""
+        response = client.get("/health")
+        assert "app;dur=" in response.headers["server-timing"]
+        
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'http_request_duration_seconds_count{method="GET",route="/health",status="200"}' in response.text
+
 class TestExpenses:
     """Tests para endpoints de gastos"""
     
@@ -93,7 +212,7 @@ class TestExpenses:
         headers = {"Authorization": f"Bearer {auth_token}"}
         expense_data = {
             "amount": 100.50,
-            "category": "food",
+            "category": "comestibles",
             "description": "Test expense",
             "date": datetime.now().isoformat()
         }
@@ -110,7 +229,7 @@ class TestExpenses:
         """Test creación de gasto sin autenticación"""
         expense_data = {
             "amount": 100.50,
-            "category": "food",
+            "category": "comestibles",
             "description": "Test expense",
             "date": datetime.now().isoformat()
         }
@@ -125,19 +244,19 @@ class TestExpenses:
         # Crear algunos gastos
         expense_data = {
             "amount": 100.50,
-            "category": "food",
+            "category": "comestibles",
             "description": "Test expense 1",
             "date": datetime.now().isoformat()
         }
-        client.post("/expenses", json=expense_data, headers=headers)
+        assert client.post("/expenses", json=expense_data, headers=headers).status_code == 201
         
         expense_data2 = {
             "amount": 200.00,
-            "category": "transport",
+            "category": "ocio",
             "description": "Test expense 2",
             "date": datetime.now().isoformat()
         }
-        client.post("/expenses", json=expense_data2, headers=headers)
+        assert client.post("/expenses", json=expense_data2, headers=headers).status_code == 201
         
         # Listar gastos
         response = client.get("/expenses", headers=headers)
@@ -146,6 +265,109 @@ class TestExpenses:
         data = response.json()
         assert len(data) >= 2
     
+    def test_list_expenses_cache_invalidated_on_write(self, auth_token):
+        """Test caché de listado tras crear un gasto"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        before = client.get("/expenses", headers=headers).json()
+        assert client.get("/expenses", headers=headers).json() == before
+        
+        expense_data = {
+            "amount": 9.99,
+            "category": "ocio",
+            "description": "Cache expense",
+            "date": datetime.now().isoformat()
+        }
+        response = client.post("/expenses", json=expense_data, headers=headers)
+        assert response.status_code == 201
+        
+        after = client.get("/expenses", headers=headers).json()
+        assert len(after) == len(before) + 1
+        assert response.json()["id"] in {expense["id"] for expense in after}
+    
+    def test_list_expenses_cache_follows_external_write(self, auth_token):
+        """Test caché y ETag tras una escritura hecha por otro proceso"""
+        from bson import ObjectId
+        from app import rollups
+        from app.db import get_client
+        from app.config import settings
+        from app.utils import decode_token
+        
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        user_id = ObjectId(decode_token(auth_token)["sub"])
+        
+        with TestClient(app) as worker_client:
+            response = worker_client.get("/expenses", headers=headers)
+            etag = response.headers["ETag"]
+            before = len(response.json())
+            
+            # Otro worker inserta, actualiza los totales y sube la versión sin pasar por este proceso
+            db = get_client()[settings.MONGO_DB]
+            expense = {
+                "user_id": user_id,
+                "amount": 4.5,
+                "category": "ocio",
+                "description": "External expense",
+                "date": datetime.utcnow(),
+            }
+            worker_client.portal.call(db["expenses"].insert_one, expense)
+            worker_client.portal.call(rollups.apply_changes, db, (), [expense])
+            worker_client.portal.call(db["users"].update_one, {"_id": user_id}, {"$inc": {"expenses_version": 1}})
+            
+            response = worker_client.get("/expenses", headers={**headers, "If-None-Match": etag})
+            assert response.status_code == 200
+            assert response.headers["ETag"] != etag
+            assert len(response.json()) == before + 1
+    
+    def test_list_expenses_etag(self, auth_token):
+        """Test ETag e If-None-Match"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        response = client.get("/expenses", headers=headers)
+        etag = response.headers["ETag"]
+        
+        response = client.get("/expenses", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        
+        # Una escritura cambia la versión
+        expense_data = {
+            "amount": 3.5,
+            "category": "ocio",
+            "description": "ETag expense",
+            "date": datetime.now().isoformat()
+        }
+        response = client.post("/expenses", json=expense_data, headers=headers)
+        assert response.status_code == 201
+        response = client.get("/expenses", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+    
+    def test_list_expenses_gzip(self, auth_token):
+        """Test compresión gzip del listado"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        from app.config import settings
+        
+        for i in range(20):
+            expense_data = {
+                "amount": 1.0 + i,
+                "category": "comestibles",
+                "description": "Compressed expense",
+                "date": datetime.now().isoformat()
+            }
+            response = client.post("/expenses", json=expense_data, headers=headers)
+            assert response.status_code == 201
+        
+        # El listado supera el tamaño mínimo a comprimir
+        response = client.get("/expenses", headers={**headers, "Accept-Encoding": "identity"})
+        assert len(response.content) > settings.COMPRESSION_MIN_SIZE
+        assert "content-encoding" not in response.headers
+        
+        response = client.get("/expenses", headers={**headers, "Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert len(response.json()) >= 20
+    
     def test_filter_expenses_by_category(self, auth_token):
         """Test filtrado por categoría"""
         headers = {"Authorization": f"Bearer {auth_token}"}
@@ -153,26 +375,27 @@ class TestExpenses:
         # Crear gastos de diferentes categorías
         expense_data = {
             "amount": 100.50,
-            "category": "food",
+            "category": "comestibles",
             "description": "Food expense",
             "date": datetime.now().isoformat()
         }
-        client.post("/expenses", json=expense_data, headers=headers)
+        assert client.post("/expenses", json=expense_data, headers=headers).status_code == 201
         
         expense_data2 = {
             "amount": 200.00,
-            "category": "transport",
+            "category": "ocio",
             "description": "Transport expense",
             "date": datetime.now().isoformat()
         }
-        client.post("/expenses", json=expense_data2, headers=headers)
+        assert client.post("/expenses", json=expense_data2, headers=headers).status_code == 201
         
-        # Filtrar por categoría food
-        response = client.get("/expenses?category=food", headers=headers)
+        # Filtrar por categoría comestibles
+        response = client.get("/expenses?category=comestibles", headers=headers)
         assert response.status_code == 200
         
         data = response.json()
-        assert all(expense["category"] == "food" for expense in data)
+        assert data
+        assert all(expense["category"] == "comestibles" for expense in data)
     
     def test_update_expense(self, auth_token):
         """Test actualización de gasto"""
@@ -181,11 +404,12 @@ class TestExpenses:
         # Crear gasto
         expense_data = {
             "amount": 100.50,
-            "category": "food",
+            "category": "comestibles",
             "description": "Original description",
             "date": datetime.now().isoformat()
         }
         response = client.post("/expenses", json=expense_data, headers=headers)
+        assert response.status_code == 201
         expense_id = response.json()["id"]
         
         # Actualizar gasto
@@ -207,11 +431,12 @@ class TestExpenses:
         # Crear gasto
         expense_data = {
             "amount": 100.50,
-            "category": "food",
+            "category": "comestibles",
             "description": "To be deleted",
             "date": datetime.now().isoformat()
         }
         response = client.post("/expenses", json=expense_data, headers=headers)
+        assert response.status_code == 201
         expense_id = response.json()["id"]
         
         # Eliminar gasto
@@ -219,9 +444,974 @@ class TestExpenses:
         assert response.status_code == 204
         
         # Verificar que fue eliminado
-        response = client.get(f"/expenses/{expense_id}", headers=headers)
+        response = client.get("/expenses", headers=headers)
+        assert expense_id not in {expense["id"] for expense in response.json()}
+        
+        response = client.delete(f"/expenses/{expense_id}", headers=headers)
         assert response.status_code == 404
 
+    def test_paginate_expenses_with_cursor(self):
+        """Test paginación por cursor"""
+        from bson import ObjectId
+        
+        # Usuario nuevo: el número de gastos y de páginas es conocido
+        user_data = {"email": f"pages-{ObjectId()}@example.com", "password": "testpassword123"}
+        client.post("/auth/register", json=user_data)
+        token = client.post("/auth/login", json=user_data).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        for i in range(5):
+            expense_data = {
+                "amount": 10.0 + i,
+                "category": "comestibles",
+                "description": f"Paged expense {i}",
+                "date": (datetime.now() - timedelta(days=i)).isoformat()
+            }
+            response = client.post("/expenses", json=expense_data, headers=headers)
+            assert response.status_code == 201
+        
+        # Recorrer todas las páginas
+        pages = []
+        params = {"limit": 2}
+        while True:
+            response = client.get("/expenses", params=params, headers=headers)
+            assert response.status_code == 200
+            
+            data = response.json()
+            pages.append([expense["id"] for expense in data["items"]])
+            if not data["next_cursor"]:
+                break
+            params["cursor"] = data["next_cursor"]
+        
+        assert [len(page) for page in pages] == [2, 2, 1]
+        
+        # Sin solapes y en el mismo orden que el listado completo
+        ids = [expense_id for page in pages for expense_id in page]
+        assert len(set(ids)) == 5
+        response = client.get("/expenses", headers=headers)
+        assert ids == [expense["id"] for expense in response.json()]
+    
+    def test_invalid_cursor(self, auth_token):
+        """Test cursor inválido"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        response = client.get("/expenses?limit=2&cursor=invalido", headers=headers)
+        assert response.status_code == 400
+
+    def test_list_expenses_selected_fields(self, auth_token):
+        """Test selección de campos"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        expense_data = {
+            "amount": 19.9,
+            "category": "ropa",
+            "description": "Fields expense",
+            "date": datetime.now().isoformat()
+        }
+        assert client.post("/expenses", json=expense_data, headers=headers).status_code == 201
+        
+        response = client.get("/expenses?fields=amount,date", headers=headers)
+        assert response.status_code == 200
+        assert response.json()
+        assert all(set(expense) == {"amount", "date"} for expense in response.json())
+        
+        response = client.get("/expenses?fields=id,category&limit=1", headers=headers)
+        assert [set(expense) for expense in response.json()["items"]] == [{"id", "category"}]
+        
+        response = client.get("/expenses?fields=amount,password", headers=headers)
+        assert response.status_code == 400
+        
+        # El esquema OpenAPI describe la respuesta recortada
+        schema = client.get("/openapi.json").json()
+        listing = schema["paths"]["/expenses"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert {"$ref": "#/components/schemas/ExpenseFieldsPage"} in listing["anyOf"]
+        assert not schema["components"]["schemas"]["ExpenseFields"].get("required")
+    
+    def test_stream_expenses(self, auth_token):
+        """Test exportación NDJSON"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        before = len(client.get("/expenses", headers=headers).json())
+        for i in range(3):
+            expense_data = {
+                "amount": 42.0 + i,
+                "category": "electronica",
+                "description": f"Streamed expense {i}",
+                "date": datetime.now().isoformat()
+            }
+            response = client.post("/expenses", json=expense_data, headers=headers)
+            assert response.status_code == 201
+        
+        response = client.get("/expenses/stream", headers=headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        
+        lines = response.text.splitlines()
+        assert len(lines) == before + 3
+        rows = [json.loads(line) for line in lines]
+        assert [row["id"] for row in rows] == [e["id"] for e in client.get("/expenses", headers=headers).json()]
+        assert {f"Streamed expense {i}" for i in range(3)} <= {row["description"] for row in rows}
+
+    def test_expense_stats(self, auth_token):
+        """Test estadísticas por categoría y periodo"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        before = client.get("/expenses/stats?period=month", headers=headers).json()
+        
+        for amount, category in [(75.0, "comestibles"), (25.0, "ocio")]:
+            expense_data = {
+                "amount": amount,
+                "category": category,
+                "description": "Stats expense",
+                "date": datetime.utcnow().isoformat()
+            }
+            response = client.post("/expenses", json=expense_data, headers=headers)
+            assert response.status_code == 201
+        
+        response = client.get("/expenses/stats?period=month", headers=headers)
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert data["count"] == before["count"] + 2
+        assert data["total"] == pytest.approx(before["total"] + 100.0)
+        
+        def category_total(stats, category):
+            return sum(row["total"] for row in stats["by_category"] if row["category"] == category)
+        
+        assert category_total(data, "comestibles") == pytest.approx(category_total(before, "comestibles") + 75.0)
+        assert category_total(data, "ocio") == pytest.approx(category_total(before, "ocio") + 25.0)
+        
+        month = datetime.utcnow().strftime("%Y-%m")
+        def month_count(stats):
+            return sum(row["count"] for row in stats["by_period"] if row["period"] == month)
+        
+        assert month_count(data) == month_count(before) + 2
+        assert sum(row["count"] for row in data["by_period"]) == data["count"]
+        
+        # Los totales coinciden con los gastos guardados
+        expenses = client.get("/expenses", headers=headers).json()
+        assert data["count"] == len(expenses)
+        assert data["total"] == pytest.approx(sum(e["amount"] for e in expenses))
+    
+    def test_expense_stats_invalid_period(self, auth_token):
+        """Test periodo de estadísticas inválido"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        response = client.get("/expenses/stats?period=year", headers=headers)
+        assert response.status_code == 400
+
+    def test_startup_warns_when_rollups_missing(self, caplog):
+        """Test aviso al arrancar con expense_rollups vacía y gastos existentes"""
+        import logging
+        from bson import ObjectId
+        from app import rollups
+        from app.db import get_client
+        from app.config import settings
+        
+        with TestClient(app) as app_client:
+            mongo = get_client()
+            db = mongo[f"{settings.MONGO_DB}_rollups_test"]
+            app_client.portal.call(mongo.drop_database, db.name)
+            try:
+                # Despliegue anterior a expense_rollups: los gastos existen, los totales no
+                expense = {"user_id": ObjectId(), "amount": 5.0, "category": "salud", "date": datetime(2025, 1, 15)}
+                app_client.portal.call(db["expenses"].insert_one, expense)
+                with caplog.at_level(logging.WARNING, logger="app.rollups"):
+                    app_client.portal.call(rollups.check_rollups_safely, db)
+                assert "make rebuild-rollups" in caplog.text
+                
+                caplog.clear()
+                app_client.portal.call(rollups.apply_changes, db, [], [expense])
+                with caplog.at_level(logging.WARNING, logger="app.rollups"):
+                    app_client.portal.call(rollups.check_rollups_safely, db)
+                assert caplog.text == ""
+            finally:
+                app_client.portal.call(mongo.drop_database, db.name)
+    
+    def test_stats_follow_updates_and_deletes(self, auth_token):
+        """Test totales mensuales tras modificar y eliminar gastos"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        before = client.get("/expenses/stats", headers=headers).json()
+        
+        expense_data = {
+            "amount": 30.0,
+            "category": "comestibles",
+            "description": "Rollup expense",
+            "date": datetime.now().isoformat()
+        }
+        response = client.post("/expenses", json=expense_data, headers=headers)
+        assert response.status_code == 201
+        expense_id = response.json()["id"]
+        
+        data = client.get("/expenses/stats", headers=headers).json()
+        assert data["count"] == before["count"] + 1
+        assert data["total"] == pytest.approx(before["total"] + 30.0)
+        
+        response = client.patch(f"/expenses/{expense_id}", json={"amount": 45.0, "category": "ocio"}, headers=headers)
+        assert response.status_code == 200
+        
+        data = client.get("/expenses/stats", headers=headers).json()
+        assert data["count"] == before["count"] + 1
+        assert data["total"] == pytest.approx(before["total"] + 45.0)
+        ocio = {row["category"]: row["total"] for row in data["by_category"]}["ocio"]
+        assert ocio == pytest.approx({row["category"]: row["total"] for row in before["by_category"]}.get("ocio", 0.0) + 45.0)
+        
+        response = client.delete(f"/expenses/{expense_id}", headers=headers)
+        assert response.status_code == 204
+        data = client.get("/expenses/stats", headers=headers).json()
+        assert data["count"] == before["count"]
+        assert data["total"] == pytest.approx(before["total"])
+
+    def test_bulk_create_expenses(self, auth_token):
+        """Test importación en lote con filas inválidas"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        rows = [
+            {"amount": 10.0, "category": "comestibles", "description": "Bulk row 0", "date": datetime.now().isoformat()},
+            {"amount": -5, "category": "comestibles", "description": "Bulk row 1", "date": datetime.now().isoformat()},
+            {"amount": 20.0, "category": "ocio", "description": "Bulk row 2", "date": datetime.now().isoformat()},
+        ]
+        response = client.post("/expenses/bulk", json=rows, headers=headers)
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert data["inserted"] == 2
+        assert [error["row"] for error in data["errors"]] == [1]
+        
+        # Solo las filas válidas quedan guardadas
+        stored = {e["description"]: e for e in client.get("/expenses", headers=headers).json()}
+        assert stored["Bulk row 0"]["amount"] == 10.0
+        assert stored["Bulk row 2"]["category"] == "ocio"
+        assert "Bulk row 1" not in stored
+    
+    def test_bulk_create_expenses_csv(self, auth_token):
+        """Test importación en lote desde CSV"""
+        headers = {"Authorization": f"Bearer {auth_token}", "Content-Type": "text/csv"}
+        
+        body = "amount,category,description,date\n" + f"12.5,ropa,CSV expense,{datetime.now().isoformat()}\n"
+        response = client.post("/expenses/bulk", content=body, headers=headers)
+        assert response.status_code == 200
+        assert response.json() == {"inserted": 1, "errors": []}
+        
+        expenses = client.get("/expenses", headers={"Authorization": headers["Authorization"]}).json()
+        assert any(e["description"] == "CSV expense" and e["amount"] == 12.5 and e["category"] == "ropa" for e in expenses)
+
+    def test_bulk_update_and_delete(self, auth_token):
+        """Test actualización y eliminación en lote"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        ids = []
+        for i in range(3):
+            expense_data = {
+                "amount": 5.0 + i,
+                "category": "comestibles",
+                "description": f"Bulk expense {i}",
+                "date": datetime.now().isoformat()
+            }
+            response = client.post("/expenses", json=expense_data, headers=headers)
+            assert response.status_code == 201
+            ids.append(response.json()["id"])
+        
+        # Actualizar por ids
+        items = [{"id": expense_id, "changes": {"description": "Bulk updated"}} for expense_id in ids]
+        response = client.patch("/expenses/bulk", json={"items": items}, headers=headers)
+        assert response.status_code == 200
+        assert response.json() == {"matched": 3, "modified": 3}
+        
+        stored = {e["id"]: e for e in client.get("/expenses", headers=headers).json()}
+        assert all(stored[expense_id]["description"] == "Bulk updated" for expense_id in ids)
+        
+        # Eliminar por ids
+        response = client.request("DELETE", "/expenses/bulk", json={"ids": ids}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["deleted"] == 3
+        
+        stored = {e["id"] for e in client.get("/expenses", headers=headers).json()}
+        assert not stored & set(ids)
+    
+    def test_bulk_update_requires_single_mode(self, auth_token):
+        """Test lote sin ids ni filtro"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        response = client.patch("/expenses/bulk", json={"changes": {"amount": 1}}, headers=headers)
+        assert response.status_code == 400
+    
+    def test_search_expenses(self, auth_token):
+        """Test búsqueda en la descripción combinada con filtros y paginación"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        for description, category in [("Uber al aeropuerto", "ocio"), ("Uber Eats", "comestibles"), ("Netflix", "ocio")]:
+            expense_data = {
+                "amount": 9.99,
+                "category": category,
+                "description": description,
+                "date": datetime.now().isoformat()
+            }
+            client.post("/expenses", json=expense_data, headers=headers)
+        
+        response = client.get("/expenses?q=uber", headers=headers)
+        assert response.status_code == 200
+        assert all("uber" in expense["description"].lower() for expense in response.json())
+        assert len(response.json()) >= 2
+        
+        response = client.get("/expenses?q=uber&category=ocio&rango=this_month", headers=headers)
+        assert all(expense["category"] == "ocio" for expense in response.json())
+        
+        response = client.get("/expenses?q=uber&limit=1", headers=headers)
+        assert len(response.json()["items"]) == 1
+        assert response.json()["next_cursor"] is not None
+        
+        response = client.get("/expenses?q=%20", headers=headers)
+        assert response.status_code == 400
+
+class TestExports:
+    """Tests para exportaciones en segundo plano"""
+    
+    def test_csv_export(self, monkeypatch):
+        """Test exportación CSV encolada, procesada y descargada"""
+        import time
+        from app.config import settings
+        
+        # Por defecto exporta un proceso aparte; aquí el worker arranca con el lifespan
+        monkeypatch.setattr(settings, "EXPORT_WORKERS", 1)
+        with TestClient(app) as export_client:
+            user_data = {"email": "exports@example.com", "password": "testpassword123"}
+            export_client.post("/auth/register", json=user_data)
+            token = export_client.post("/auth/login", json=user_data).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            export_client.post("/expenses", json={
+                "amount": 42.0,
+                "category": "ocio",
+                "description": "Exportado",
+                "date": datetime.now().isoformat()
+            }, headers=headers)
+            
+            response = export_client.post("/expenses/exports?format=csv", headers=headers)
+            assert response.status_code == 202
+            job = response.json()
+            assert response.headers["location"] == f"/expenses/exports/{job['id']}"
+            
+            for _ in range(50):
+                job = export_client.get(f"/expenses/exports/{job['id']}", headers=headers).json()
+                if job["status"] == "done":
+                    break
+                time.sleep(0.1)
+            assert job["status"] == "done"
+            
+            download = export_client.get(job["download_url"], headers=headers)
+            assert download.status_code == 200
+            lines = download.text.strip().splitlines()
+            assert lines[0] == "id,amount,category,description,date"
+            assert len(lines) - 1 == job["rows"]
+    
+    def test_export_invalid_format(self):
+        """Test formato de exportación no soportado"""
+        user_data = {"email": "exports2@example.com", "password": "testpassword123"}
+        client.post("/auth/register", json=user_data)
+        token = client.post("/auth/login", json=user_data).json()["access_token"]
+        
+        response = client.post("/expenses/exports?format=xlsx", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 400
+
+class TestIndexes:
+    """Tests para la gestión de índices"""
+    
+    def test_startup_creates_required_indexes(self):
+        """Test índices creados en el arranque"""
+        from app import indexes
+        from app.db import get_client
+        from app.config import settings
+        
+        # El context manager ejecuta el lifespan de la aplicación
+        with TestClient(app) as startup_client:
+            assert startup_client.get("/health").status_code == 200
+            db = get_client()[settings.MONGO_DB]
+            report = startup_client.portal.call(indexes.index_report, db)
+        
+        assert all(not status["missing"] for status in report.values())
+    
+    def test_report_tolerates_special_indexes(self):
+        """Test índices hashed o geoespaciales creados a mano solo se informan como sobrantes"""
+        from pymongo import IndexModel
+        from app import indexes
+        from app.db import get_client
+        from app.config import settings
+        
+        assert indexes._key([("email", "hashed"), ("loc", "2dsphere")]) == (("email", "hashed"), ("loc", "2dsphere"))
+        assert indexes._key([("date", -1.0)]) == (("date", -1),)
+        
+        with TestClient(app) as startup_client:
+            db = get_client()[settings.MONGO_DB]
+            startup_client.portal.call(db["users"].create_indexes, [IndexModel([("email", "hashed")], name="email_hashed_test")])
+            try:
+                report = startup_client.portal.call(indexes.index_report, db)
+            finally:
+                startup_client.portal.call(db["users"].drop_index, "email_hashed_test")
+        
+        assert "email_hashed_test" in report["users"]["extra"]
+    
+    def test_list_filters_use_indexes(self):
+        """Test cada combinación de filtros y orden del listado usa un índice (explain)"""
+        import inspect
+        import itertools
+        from bson import ObjectId
+        from app import main
+        from app.db import get_client
+        from app.config import settings
+        from app.models import Category
+        
+        def stages(plan):
+            plan = plan.get("queryPlan", plan)
+            children = plan.get("inputStages") or ([plan["inputStage"]] if "inputStage" in plan else [])
+            return [plan["stage"]] + [stage for child in children for stage in stages(child)]
+        
+        user_id = ObjectId()
+        categories = [Category.ropa, Category.salud, Category.ocio]
+        expenses = [
+            {"user_id": user_id, "amount": 5.0 * (i + 1), "category": categories[i % 3].value, "date": datetime.now() - timedelta(days=i)}
+            for i in range(60)
+        ]
+        defaults = {name: None for name in inspect.signature(main.expense_query).parameters}
+        
+        with TestClient(app) as index_client:
+            db = get_client()[settings.MONGO_DB]
+            index_client.portal.call(db["expenses"].insert_many, expenses)
+            
+            combinations = itertools.product(
+                [None, [Category.ropa], [Category.ropa, Category.salud]],
+                [(None, None), (100.0, None), (50.0, 200.0)],
+                [None, "this_month"],
+                main.SORTS,
+            )
+            for category, (min_amount, max_amount), rango, sort in combinations:
+                q = main.expense_query(**{**defaults, "user_id": user_id, "category": category, "min_amount": min_amount, "max_amount": max_amount, "rango": rango})
+                cursor = db["expenses"].find(q).sort(main.sort_spec(sort)).limit(51)
+                plan = stages(index_client.portal.call(cursor.explain)["queryPlanner"]["winningPlan"])
+                assert "COLLSCAN" not in plan and "IXSCAN" in plan, (q, sort, plan)
+                
+                # Sin rango sobre otro campo el índice también da el orden: sin SORT en memoria
+                field = main.SORTS[sort][0]
+                if not any(key in q for key in ("date", "amount") if key != field):
+                    assert "SORT" not in plan, (q, sort, plan)
+            
+            index_client.portal.call(db["expenses"].delete_many, {"user_id": user_id})
+
+class TestTimeseriesStorage:
+    """Tests para el almacenamiento time-series con versiones (requiere MongoDB 7.0+)"""
+    
+    @pytest.fixture
+    def timeseries_db(self, monkeypatch):
+        """Base de datos aparte con expenses como colección time-series"""
+        from app import storage
+        from app.db import get_client
+        from app.config import settings
+        
+        with TestClient(app) as ts_client:
+            mongo = get_client()
+            version = ts_client.portal.call(mongo.server_info)["version"]
+            if tuple(int(part) for part in version.split(".")[:2]) < (7, 0):
+                pytest.skip(f"time-series con versiones requiere MongoDB 7.0+ (servidor {version})")
+            
+            db = mongo[f"{settings.MONGO_DB}_timeseries_test"]
+            ts_client.portal.call(mongo.drop_database, db.name)
+            monkeypatch.setattr(storage.settings, "EXPENSES_STORAGE", "timeseries")
+            ts_client.portal.call(storage.ensure_collection, db)
+            yield ts_client.portal, db
+            ts_client.portal.call(mongo.drop_database, db.name)
+    
+    @staticmethod
+    def expense(user_id, amount, category="ocio", **extra):
+        from bson import ObjectId
+        return {"_id": ObjectId(), "user_id": user_id, "amount": amount, "category": category, "date": datetime(2025, 1, 15), **extra}
+    
+    def test_text_filter_fallback(self, monkeypatch):
+        """Test búsqueda sin índice de texto en time-series"""
+        from app import storage
+        
+        monkeypatch.setattr(storage.settings, "EXPENSES_STORAGE", "documents")
+        assert storage.text_filter("uber eats") == {"$text": {"$search": "uber eats"}}
+        
+        monkeypatch.setattr(storage.settings, "EXPENSES_STORAGE", "timeseries")
+        assert storage.text_filter("uber a.b") == {"description": {"$regex": "uber|a|b", "$options": "i"}}
+    
+    def test_update_and_delete_replace_versions(self, timeseries_db):
+        """Test modificar inserta una versión nueva y borra la anterior"""
+        from bson import ObjectId
+        from app import storage
+        
+        portal, db = timeseries_db
+        user_id = ObjectId()
+        doc = self.expense(user_id, 10.0)
+        portal.call(db["expenses"].insert_one, doc)
+        
+        old = portal.call(storage.update_expense, db, user_id, doc["_id"], {"amount": 15.0})
+        assert old["amount"] == 10.0
+        versions = portal.call(db["expenses"].find({"_id": doc["_id"]}).to_list, None)
+        assert [(v["amount"], v["rev"]) for v in versions] == [(15.0, 1)]
+        
+        assert portal.call(storage.update_expense, db, user_id, ObjectId(), {"amount": 1.0}) is None
+        
+        deleted = portal.call(storage.delete_expense, db, user_id, doc["_id"])
+        assert deleted["amount"] == 15.0
+        assert portal.call(db["expenses"].count_documents, {"user_id": user_id}) == 0
+    
+    def test_update_expenses_by_filter(self, timeseries_db):
+        """Test modificación en lote con versiones"""
+        from bson import ObjectId
+        from app import storage
+        
+        portal, db = timeseries_db
+        user_id = ObjectId()
+        docs = [self.expense(user_id, 5.0), self.expense(user_id, 7.0), self.expense(user_id, 9.0, "ropa")]
+        portal.call(db["expenses"].insert_many, docs)
+        
+        matched, modified, old, new = portal.call(
+            storage.update_expenses, db, {"user_id": user_id, "category": "ocio"}, {None: {"category": "salud"}}, True,
+        )
+        assert (matched, modified) == (2, 2)
+        assert sorted(doc["amount"] for doc in new) == [5.0, 7.0]
+        assert all(doc["category"] == "salud" for doc in new)
+        assert portal.call(db["expenses"].count_documents, {"user_id": user_id}) == 3
+    
+    def test_duplicate_versions_are_read_once(self, timeseries_db):
+        """Test una versión huérfana (caída entre insertar y borrar) no se duplica al leer"""
+        from bson import ObjectId
+        from app import rollups, storage
+        
+        portal, db = timeseries_db
+        user_id = ObjectId()
+        doc = self.expense(user_id, 10.0)
+        other = self.expense(user_id, 3.0)
+        # Versión nueva insertada sin borrar la anterior
+        portal.call(db["expenses"].insert_many, [doc, other, {**doc, "amount": 12.0, "rev": 1}])
+        
+        rows = portal.call(storage.find_expenses(db, {"user_id": user_id}, sort=[("amount", -1), ("_id", -1)]).to_list, None)
+        assert [row["amount"] for row in rows] == [12.0, 3.0]
+        
+        totals = portal.call(db["expenses"].aggregate([
+            *storage.match_stages({"user_id": user_id}),
+            {"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}},
+        ]).to_list, None)
+        assert (totals[0]["total"], totals[0]["count"]) == (15.0, 2)
+        
+        portal.call(db[rollups.ROLLUPS].create_index, [("user_id", 1), ("year_month", 1), ("category", 1)], unique=True)
+        portal.call(rollups.rebuild_rollups, db, user_id)
+        rollup = portal.call(db[rollups.ROLLUPS].find_one, {"user_id": user_id})
+        assert (rollup["total"], rollup["count"]) == (15.0, 2)
+        
+        # La siguiente modificación elimina la versión sobrante
+        old = portal.call(storage.update_expense, db, user_id, doc["_id"], {"amount": 20.0})
+        assert old["amount"] == 12.0
+        versions = portal.call(db["expenses"].find({"_id": doc["_id"]}).to_list, None)
+        assert [(v["amount"], v["rev"]) for v in versions] == [(20.0, 2)]
+    
+    def test_match_stages_filter_after_dedupe(self, monkeypatch):
+        """Test solo user_id y _id se filtran antes de descartar versiones antiguas"""
+        from bson import ObjectId
+        from app import storage
+        
+        monkeypatch.setattr(storage.settings, "EXPENSES_STORAGE", "timeseries")
+        user_id, oid = ObjectId(), ObjectId()
+        seek = [{"date": {"$lt": datetime(2025, 1, 1)}}]
+        stages = storage.match_stages({"user_id": user_id, "_id": {"$in": [oid]}, "category": "ocio", "$or": seek})
+        assert stages[0] == {"$match": {"user_id": user_id, "_id": {"$in": [oid]}}}
+        assert stages[1:-1] == storage.latest_versions()
+        assert stages[-1] == {"$match": {"category": "ocio", "$or": seek}}
+        
+        assert storage.match_stages({"user_id": user_id}) == [{"$match": {"user_id": user_id}}, *storage.latest_versions()]
+    
+    def test_stale_version_does_not_match_old_values(self, timeseries_db):
+        """Test una versión huérfana no aparece por su categoría o fecha antiguas"""
+        from bson import ObjectId
+        from app import storage
+        
+        portal, db = timeseries_db
+        user_id = ObjectId()
+        doc = self.expense(user_id, 10.0)
+        current = {**doc, "category": "salud", "date": datetime(2025, 3, 1), "rev": 1}
+        portal.call(db["expenses"].insert_many, [doc, current])
+        
+        def ids(q):
+            rows = portal.call(storage.find_expenses(db, {"user_id": user_id, **q}).to_list, None)
+            return [row["_id"] for row in rows]
+        
+        assert ids({"category": "ocio"}) == []
+        assert ids({"category": "salud"}) == [doc["_id"]]
+        assert ids({"date": {"$lt": datetime(2025, 2, 1)}}) == []
+        assert ids({"date": {"$gte": datetime(2025, 2, 1)}}) == [doc["_id"]]
+        
+        by_category = portal.call(db["expenses"].aggregate([
+            *storage.match_stages({"user_id": user_id}),
+            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+        ]).to_list, None)
+        assert by_category == [{"_id": "salud", "count": 1}]
+    
+    def test_bulk_update_reads_every_version(self, timeseries_db):
+        """Test la modificación en lote parte de la versión actual aunque otra coincida con el filtro"""
+        from bson import ObjectId
+        from app import storage
+        
+        portal, db = timeseries_db
+        user_id = ObjectId()
+        doc = self.expense(user_id, 10.0)
+        portal.call(db["expenses"].insert_many, [doc, {**doc, "category": "salud", "amount": 12.0, "rev": 1}])
+        
+        # Solo la versión huérfana es de ocio: el gasto ya no coincide
+        matched, modified, _, _ = portal.call(
+            storage.update_expenses, db, {"user_id": user_id, "category": "ocio"}, {None: {"category": "ropa"}}, True,
+        )
+        assert (matched, modified) == (0, 0)
+        
+        matched, modified, old, new = portal.call(
+            storage.update_expenses, db, {"user_id": user_id}, {None: {"amount": 30.0}}, True,
+        )
+        assert (matched, modified) == (1, 1)
+        assert (old[0]["amount"], old[0]["category"]) == (12.0, "salud")
+        versions = portal.call(db["expenses"].find({"_id": doc["_id"]}).to_list, None)
+        assert [(v["amount"], v["category"], v["rev"]) for v in versions] == [(30.0, "salud", 2)]
+    
+    def test_migrate_to_documents_drops_old_versions(self, timeseries_db):
+        """Test migración a documentos con versiones duplicadas"""
+        from bson import ObjectId
+        from app import storage
+        
+        portal, db = timeseries_db
+        user_id = ObjectId()
+        doc = self.expense(user_id, 10.0)
+        portal.call(db["expenses"].insert_many, [doc, {**doc, "amount": 11.0, "rev": 1}, self.expense(user_id, 4.0)])
+        
+        assert portal.call(storage.migrate, db, "documents") == 2
+        assert portal.call(storage.collection_type, db) == "collection"
+        migrated = portal.call(db["expenses"].find_one, {"_id": doc["_id"]})
+        assert migrated["amount"] == 11.0 and "rev" not in migrated
+        # La copia de seguridad conserva todas las versiones
+        assert portal.call(db["expenses_timeseries_backup"].count_documents, {}) == 3
+
+class TestServer:
+    """Tests para el lanzador de producción"""
+    
+    def test_worker_count_from_settings(self, monkeypatch):
+        """Test WEB_CONCURRENCY fija el número de workers"""
+        from app import server
+        
+        monkeypatch.setattr(server.settings, "WEB_CONCURRENCY", 3)
+        assert server.worker_count() == 3
+        
+        monkeypatch.setattr(server.settings, "WEB_CONCURRENCY", 0)
+        assert server.worker_count() >= 1
+    
+    def test_gunicorn_options(self):
+        """Test opciones de gunicorn desde Settings"""
+        from app import server
+        from app.config import settings
+        
+        options = server.gunicorn_options(4)
+        assert options["workers"] == 4
+        assert options["bind"] == f"{settings.HOST}:{settings.PORT}"
+        assert options["worker_class"] == "app.server.Worker"
+        assert options["graceful_timeout"] == settings.SERVER_GRACEFUL_TIMEOUT
+
+    def test_prepare_workers(self, monkeypatch, tmp_path):
+        """Test con varios workers se mantiene la caché en memoria y se comparte METRICS_DIR"""
+        from app import server
+
+        monkeypatch.setenv("CACHE_BACKEND", "memory")
+        monkeypatch.setenv("METRICS_DIR", "")
+        monkeypatch.setattr(server.settings, "CACHE_BACKEND", "memory")
+        monkeypatch.setattr(server.settings, "METRICS_ENABLED", True)
+        monkeypatch.setattr(server.settings, "METRICS_DIR", str(tmp_path))
+        (tmp_path / "1.json").write_text("{}")
+
+        server.prepare_workers(4)
+        assert server.settings.CACHE_BACKEND == "memory"
+        assert os.environ["CACHE_BACKEND"] == "memory"
+        assert list(tmp_path.glob("*.json")) == []
+
+        monkeypatch.setattr(server.settings, "METRICS_DIR", "")
+        server.prepare_workers(4)
+        assert os.path.isdir(os.environ["METRICS_DIR"])
+        assert server.settings.METRICS_DIR == os.environ["METRICS_DIR"]
+        os.rmdir(os.environ["METRICS_DIR"])
+
+    def test_metrics_from_all_workers(self, tmp_path):
+        """Test /metrics une las instantáneas de los workers con la etiqueta worker"""
+        from app import metrics
+
+        metrics.write_snapshot(str(tmp_path))
+        own = json.loads((tmp_path / f"{os.getpid()}.json").read_text())
+        for worker in ("99999999", "99999998"):
+            families = {
+                name: {**family, "samples": [sample.replace(f'worker="{os.getpid()}"', f'worker="{worker}"') for sample in family["samples"]]}
+                for name, family in own.items()
+            }
+            (tmp_path / f"{worker}.json").write_text(json.dumps(families))
+        # Un worker muerto deja de actualizar su instantánea
+        os.utime(tmp_path / "99999998.json", (0, 0))
+
+        body = metrics.render_workers(str(tmp_path), max_age=60)
+        assert body.count("# TYPE http_requests_in_flight gauge") == 1
+        assert f'http_requests_in_flight{{worker="{os.getpid()}"}}' in body
+        assert 'http_requests_in_flight{worker="99999999"}' in body
+        assert 'worker="99999998"' not in body
+
+        metrics.remove_snapshot(str(tmp_path))
+        assert not (tmp_path / f"{os.getpid()}.json").exists()
+
+class TestInsertBatcher:
+    """Tests para las altas agrupadas"""
+    
+    def test_write_concern_from_settings(self, monkeypatch):
+        """Test write concern configurable del escritor agrupado"""
+        from app import writer
+        
+        monkeypatch.setattr(writer.settings, "INSERT_WRITE_CONCERN", "")
+        monkeypatch.setattr(writer.settings, "INSERT_JOURNAL", None)
+        assert writer.write_concern() is None
+        
+        monkeypatch.setattr(writer.settings, "INSERT_WRITE_CONCERN", "majority")
+        monkeypatch.setattr(writer.settings, "INSERT_JOURNAL", True)
+        assert writer.write_concern().document == {"w": "majority", "j": True}
+        
+        monkeypatch.setattr(writer.settings, "INSERT_WRITE_CONCERN", "1")
+        monkeypatch.setattr(writer.settings, "INSERT_JOURNAL", None)
+        assert writer.write_concern().document == {"w": 1}
+    
+    @pytest.fixture
+    def batcher_db(self):
+        """Colección aparte para el escritor agrupado"""
+        from app.db import get_client
+        from app.config import settings
+        
+        with TestClient(app) as batch_client:
+            db = get_client()[settings.MONGO_DB]
+            batch_client.portal.call(db["insert_batcher_test"].drop)
+            yield batch_client.portal, db
+            batch_client.portal.call(db["insert_batcher_test"].drop)
+    
+    @staticmethod
+    def recorder():
+        flushed = []
+        
+        async def on_flush(db, docs):
+            flushed.append([doc["_id"] for doc in docs])
+        
+        return flushed, on_flush
+    
+    def test_flush_by_size(self, batcher_db):
+        """Test el lote se escribe al llegar a INSERT_BATCH_MAX sin esperar la ventana"""
+        import asyncio
+        from app.writer import InsertBatcher
+        
+        portal, db = batcher_db
+        flushed, on_flush = self.recorder()
+        batcher = InsertBatcher("insert_batcher_test", on_flush, max_batch=3, window_ms=60_000)
+        
+        async def run():
+            return await asyncio.wait_for(asyncio.gather(*(batcher.insert(db, {"n": i}) for i in range(3))), 5)
+        
+        ids = portal.call(run)
+        assert len(set(ids)) == 3
+        assert flushed == [ids]
+        assert portal.call(db["insert_batcher_test"].count_documents, {}) == 3
+    
+    def test_flush_by_window(self, batcher_db):
+        """Test un lote incompleto se escribe al cumplirse la ventana"""
+        import asyncio
+        from app.writer import InsertBatcher
+        
+        portal, db = batcher_db
+        flushed, on_flush = self.recorder()
+        batcher = InsertBatcher("insert_batcher_test", on_flush, max_batch=100, window_ms=20)
+        
+        async def run():
+            return await asyncio.wait_for(asyncio.gather(batcher.insert(db, {"n": 1}), batcher.insert(db, {"n": 2})), 5)
+        
+        ids = portal.call(run)
+        assert len(set(ids)) == 2
+        assert flushed == [list(ids)]
+        docs = portal.call(db["insert_batcher_test"].find({}, {"n": 1}).to_list, None)
+        assert {doc["_id"]: doc["n"] for doc in docs} == {ids[0]: 1, ids[1]: 2}
+    
+    def test_row_error_only_fails_its_request(self, batcher_db):
+        """Test un error de fila (_id duplicado) no afecta al resto del lote"""
+        import asyncio
+        from bson import ObjectId
+        from pymongo.errors import BulkWriteError
+        from app.writer import InsertBatcher
+        
+        portal, db = batcher_db
+        flushed, on_flush = self.recorder()
+        batcher = InsertBatcher("insert_batcher_test", on_flush, max_batch=2, window_ms=60_000)
+        taken = ObjectId()
+        portal.call(db["insert_batcher_test"].insert_one, {"_id": taken})
+        
+        async def run():
+            return await asyncio.gather(
+                batcher.insert(db, {"_id": taken, "n": 1}),
+                batcher.insert(db, {"n": 2}),
+                return_exceptions=True,
+            )
+        
+        duplicate, ok = portal.call(run)
+        assert isinstance(duplicate, BulkWriteError)
+        assert isinstance(ok, ObjectId)
+        assert flushed == [[ok]]
+    
+    @pytest.mark.parametrize("error", ["mongo", "code"])
+    def test_post_process_failure_keeps_inserted_rows(self, batcher_db, error):
+        """Test un fallo tras escribir el lote no hace fallar las peticiones"""
+        import asyncio
+        from pymongo.errors import PyMongoError
+        from app.writer import InsertBatcher
+        
+        portal, db = batcher_db
+        
+        async def on_flush(db, docs):
+            if error == "mongo":
+                raise PyMongoError("versión no actualizada")
+            raise KeyError("category")
+        
+        batcher = InsertBatcher("insert_batcher_test", on_flush, max_batch=2, window_ms=60_000)
+        
+        async def run():
+            return await asyncio.wait_for(asyncio.gather(batcher.insert(db, {"n": 1}), batcher.insert(db, {"n": 2})), 5)
+        
+        ids = portal.call(run)
+        assert len(set(ids)) == 2
+        assert portal.call(db["insert_batcher_test"].count_documents, {}) == 2
+    
+    def test_insert_error_fails_every_request(self, batcher_db):
+        """Test un error que no es de MongoDB (documento no codificable) responde a todo el lote"""
+        import asyncio
+        from bson.errors import InvalidDocument
+        from app.writer import InsertBatcher
+        
+        portal, db = batcher_db
+        flushed, on_flush = self.recorder()
+        batcher = InsertBatcher("insert_batcher_test", on_flush, max_batch=2, window_ms=60_000)
+        
+        async def run():
+            return await asyncio.wait_for(asyncio.gather(
+                batcher.insert(db, {"n": object()}),
+                batcher.insert(db, {"n": 2}),
+                return_exceptions=True,
+            ), 5)
+        
+        results = portal.call(run)
+        assert all(isinstance(result, InvalidDocument) for result in results)
+        assert flushed == []
+    
+    def test_close_drains_pending_inserts(self, batcher_db):
+        """Test close() escribe lo pendiente sin esperar la ventana"""
+        import asyncio
+        from app.writer import InsertBatcher
+        
+        portal, db = batcher_db
+        flushed, on_flush = self.recorder()
+        batcher = InsertBatcher("insert_batcher_test", on_flush, max_batch=100, window_ms=60_000)
+        
+        async def run():
+            pending = [asyncio.create_task(batcher.insert(db, {"n": i})) for i in range(3)]
+            await asyncio.sleep(0)
+            await asyncio.wait_for(batcher.close(), 5)
+            # La ventana es de un minuto: solo close() puede haber escrito el lote
+            return await asyncio.wait_for(asyncio.gather(*pending), 1)
+        
+        ids = portal.call(run)
+        assert len(set(ids)) == 3
+        assert flushed == [ids]
+        assert portal.call(db["insert_batcher_test"].count_documents, {}) == 3
+
+class TestRanges:
+    """Tests para los rangos de fecha"""
+    
+    def test_calendar_ranges(self):
+        """Test límites de los rangos de calendario"""
+        from zoneinfo import ZoneInfo
+        from app import ranges
+        
+        utc = ZoneInfo("UTC")
+        now = datetime(2025, 3, 15, 23, 30)
+        assert ranges.calendar_range("this_month", utc, now) == (datetime(2025, 3, 1), datetime(2025, 4, 1))
+        assert ranges.calendar_range("last_month", utc, datetime(2025, 1, 10)) == (datetime(2024, 12, 1), datetime(2025, 1, 1))
+        assert ranges.calendar_range("last_week", utc, now) == (datetime(2025, 3, 3), datetime(2025, 3, 10))
+        assert ranges.calendar_range("ytd", utc, now) == (datetime(2025, 1, 1), datetime(2025, 3, 16))
+        assert ranges.calendar_range("iso_week", utc, now, "2025-W07") == (datetime(2025, 2, 10), datetime(2025, 2, 17))
+        
+        # 23:30 UTC del 31 de marzo ya es abril en Madrid (UTC+2)
+        madrid = ZoneInfo("Europe/Madrid")
+        assert ranges.calendar_range("this_month", madrid, datetime(2025, 3, 31, 23, 30)) == (datetime(2025, 3, 31, 22), datetime(2025, 4, 30, 22))
+    
+    def test_rolling_range_is_stable(self):
+        """Test los rangos móviles no cambian dentro del mismo minuto"""
+        from app import ranges
+        
+        first = ranges.rolling_range("past_week", datetime(2025, 3, 15, 10, 0, 5))
+        assert first == ranges.rolling_range("past_week", datetime(2025, 3, 15, 10, 0, 55))
+        assert first == (datetime(2025, 3, 8, 10, 1), datetime(2025, 3, 15, 10, 1))
+    
+    def test_invalid_week_and_timezone(self):
+        """Test semana o zona horaria inválidas"""
+        user_data = {"email": "ranges@example.com", "password": "testpassword123"}
+        client.post("/auth/register", json=user_data)
+        token = client.post("/auth/login", json=user_data).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = client.get("/expenses?rango=iso_week&week=2025-07", headers=headers)
+        assert response.status_code == 400
+        
+        response = client.get("/expenses?rango=this_month&tz=Mars/Base", headers=headers)
+        assert response.status_code == 400
+
+class TestSlowQueryLog:
+    """Tests para el resumen de planes de consulta"""
+    
+    def test_plan_summary_index_scan(self):
+        """Test plan con índice"""
+        from app.querylog import plan_summary
+        
+        plan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "user_id_1_date_-1__id_-1"}}
+        assert plan_summary(plan) == "FETCH > IXSCAN(user_id_1_date_-1__id_-1)"
+    
+    def test_plan_summary_collection_scan(self):
+        """Test plan sin índice (motor SBE)"""
+        from app.querylog import plan_summary
+        
+        plan = {"queryPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}
+        assert plan_summary(plan) == "SORT > COLLSCAN"
+    
+    def test_every_slow_query_is_explained_up_to_the_limit(self, monkeypatch, caplog):
+        """Test explain() en cada consulta lenta, salvo con el máximo de explain en curso"""
+        import asyncio
+        import logging
+        from app import querylog
+        
+        monkeypatch.setattr(querylog.settings, "SLOW_QUERY_MS", 100)
+        monkeypatch.setattr(querylog.settings, "SLOW_QUERY_EXPLAIN_CONCURRENCY", 1)
+        
+        class Cursor:
+            async def explain(self):
+                await asyncio.sleep(0.01)
+                return {
+                    "executionStats": {"totalDocsExamined": 900, "totalKeysExamined": 0},
+                    "queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}},
+                }
+        
+        async def run():
+            for _ in range(2):
+                querylog.log_if_slow(Cursor, {"user_id": "u"}, 0.5, 10)
+            querylog.log_if_slow(None, {"user_id": "u"}, 0.5, 10)
+            querylog.log_if_slow(Cursor, {"user_id": "u"}, 0.05, 10)
+            await asyncio.gather(*querylog._pending)
+        
+        with caplog.at_level(logging.WARNING, logger="app.slow_queries"):
+            asyncio.run(run())
+        
+        messages = [record.getMessage() for record in caplog.records]
+        assert len(messages) == 3
+        assert any("900 docs / 0 claves examinados, plan COLLSCAN" in message for message in messages)
+        assert any("explain omitido, 1 en curso" in message for message in messages)
+        assert any("explain no disponible" in message for message in messages)
+
 class TestValidation:
     """Tests para validación de datos"""
     